@@ -0,0 +1,29 @@
+import os
+import timeit
+
+import django
+
+
+def setup():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    return lambda: connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def bench(name, func, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=5))
+    us = seconds / number * 10**6
+    print('{:<50} {:>10.1f} us'.format(name, us))  # noqa: T201
+
+
+def in_deep_stack(func, depth=50):
+    if depth:
+        return in_deep_stack(func, depth - 1)
+    return func()
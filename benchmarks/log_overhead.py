@@ -0,0 +1,37 @@
+"""
+Per-save overhead of log params and serialization, without queries.
+
+    $ python -m benchmarks.log_overhead
+"""
+from benchmarks import bench, setup
+
+
+def run():
+    from simple_log.models import SimpleLog
+    from simple_log.utils import serialize_instance
+    from tests.test_app.models import RelatedModel, ThirdModel
+
+    obj = RelatedModel(
+        pk=1,
+        char_field='test',
+        third_model=ThirdModel(pk=1, char_field='third'),
+    )
+
+    bench(
+        'get_log_params',
+        lambda: SimpleLog.get_log_params(obj),
+        number=50000,
+    )
+    bench(
+        'serialize_instance',
+        lambda: serialize_instance(obj),
+        number=50000,
+    )
+
+
+if __name__ == '__main__':
+    teardown = setup()
+    try:
+        run()
+    finally:
+        teardown()
@@ -0,0 +1,61 @@
+"""
+Size of saved log values and encode/decode time with compression.
+
+    $ python -m benchmarks.log_payload
+"""
+from benchmarks import bench, setup
+
+
+def run():
+    from django.db import connection
+    from django.test import override_settings
+
+    from simple_log.models import SimpleLog
+    from simple_log.utils import disable_logging, serialize_instance
+    from tests.test_app.models import OtherModel, TestModel
+
+    with disable_logging():
+        others = [
+            OtherModel.objects.create(char_field='Other entry %d' % i)
+            for i in range(100)
+        ]
+        obj = TestModel.objects.create(
+            char_field='Lorem ipsum dolor sit amet ' * 3,
+            fk_field=others[0],
+        )
+        obj.m2m_field.set(others)
+    values = [serialize_instance(obj), serialize_instance(others[0])]
+    field = SimpleLog._meta.get_field('new')
+
+    for compress in (None, 'zlib', 'lzma'):
+        with override_settings(
+            SIMPLE_LOG_COMPRESS=compress, SIMPLE_LOG_COMPRESS_THRESHOLD=1024
+        ):
+            for value in values:
+                name = '{}, {} fields'.format(compress or 'plain', len(value))
+                saved = field.get_db_prep_save(value, connection)
+                print(  # noqa: T201
+                    '{:<50} {:>10} bytes'.format(name, len(saved))
+                )
+                bench(
+                    name + ' encode',
+                    lambda value=value: field.get_db_prep_save(
+                        value, connection
+                    ),
+                    number=1000,
+                )
+                bench(
+                    name + ' decode',
+                    lambda saved=saved: field.from_db_value(
+                        saved, None, connection
+                    ),
+                    number=1000,
+                )
+
+
+if __name__ == '__main__':
+    teardown = setup()
+    try:
+        run()
+    finally:
+        teardown()
@@ -0,0 +1,50 @@
+"""
+Cost of m2m_changed handler, measured in deep stack like in a real request.
+
+    $ python -m benchmarks.m2m_handler
+"""
+from benchmarks import bench, in_deep_stack, setup
+
+
+def run():
+    from django.db.transaction import atomic
+
+    from simple_log.signals import log_m2m_change_handler
+    from simple_log.utils import disable_logging
+    from tests.test_app.models import OtherModel, TestModel
+
+    with disable_logging():
+        obj = TestModel.objects.create(char_field='test')
+        other = OtherModel.objects.create(char_field='other')
+    through = TestModel.m2m_field.through
+
+    def handler():
+        with disable_logging():
+            log_m2m_change_handler(
+                through, obj, 'pre_add', pk_set={other.pk}, using='default'
+            )
+
+    def add_remove():
+        with atomic():
+            obj.m2m_field.add(other)
+        with atomic():
+            obj.m2m_field.remove(other)
+
+    bench(
+        'm2m_changed handler (skipped)',
+        lambda: in_deep_stack(handler),
+        number=1000,
+    )
+    bench(
+        'm2m add + remove with logging',
+        lambda: in_deep_stack(add_remove),
+        number=50,
+    )
+
+
+if __name__ == '__main__':
+    teardown = setup()
+    try:
+        run()
+    finally:
+        teardown()
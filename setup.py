@@ -21,7 +21,14 @@ setup(
     author_email='grishkokot@gmail.com',
     url='https://github.com/kindlycat/django-simple-log/',
     packages=find_namespace_packages(
-        exclude=('manage', 'tests', 'tests.*', 'docs')
+        exclude=(
+            'manage',
+            'tests',
+            'tests.*',
+            'benchmarks',
+            'benchmarks.*',
+            'docs',
+        )
     ),
     include_package_data=True,
     install_requires=['Django>=1.11', 'django-request-vars>=1.0.1'],
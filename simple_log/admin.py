@@ -5,10 +5,11 @@ from django.contrib.admin.utils import quote
 from django.contrib.admin.views.main import ChangeList
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import PermissionDenied
+from django.db.models import prefetch_related_objects
 from django.urls import reverse
 
 from simple_log.conf import settings
-from simple_log.utils import get_log_model
+from simple_log.utils import get_log_model, prefetch_snapshots
 
 
 def filter_ct(val):
@@ -75,7 +76,8 @@ class SimpleLogModelAdmin(admin.ModelAdmin):
         ret = super(SimpleLogModelAdmin, self).get_list_filter(request)
         if self.history_for_model:
             ret = filter(filter_ct, ret)
-        return ret
+        content_type_field = self.model.content_type_field
+        return [content_type_field if x == 'content_type' else x for x in ret]
 
     def get_queryset(self, request):
         qs = super(SimpleLogModelAdmin, self).get_queryset(request)
@@ -88,14 +90,32 @@ class SimpleLogModelAdmin(admin.ModelAdmin):
                     settings.PROXY_CONCRETE,
                 ),
             )
-            qs = qs.filter(content_type=ct)
+            qs = qs.filter(**self.model.get_content_type_filter(ct))
             if self.history_for_object:
                 qs = qs.filter(object_id=self.history_for_object)
-        return qs.select_related('content_type', 'user')
+        if settings.DATABASE:
+            qs = qs.using(settings.DATABASE)
+        related = [
+            f.name
+            for f in self.model._meta.concrete_fields
+            if f.name in ('content_type', 'user')
+        ]
+        if related:
+            qs = qs.select_related(*related)
+        return qs
 
     def get_changelist(self, request, **kwargs):
         return SimpleLogChangeList
 
+    def get_object(self, request, object_id, from_field=None):
+        obj = super(SimpleLogModelAdmin, self).get_object(
+            request, object_id, from_field
+        )
+        if obj is not None:
+            prefetch_related_objects([obj], 'related_logs')
+            prefetch_snapshots([obj] + list(obj.related_logs.all()))
+        return obj
+
 
 class HistoryModelAdmin(admin.ModelAdmin):
     change_list_template = 'simple_log/admin/change_list.html'
@@ -1,6 +1,8 @@
 from django.apps import AppConfig
+from django.core.signals import setting_changed
 from django.db.models.signals import (
     m2m_changed,
+    post_migrate,
     post_save,
     pre_delete,
     pre_save,
@@ -8,20 +10,26 @@ from django.db.models.signals import (
 from django.utils.translation import gettext_lazy as _
 
 import simple_log
+from simple_log.conf import settings
 from simple_log.signals import (
     log_m2m_change_handler,
     log_post_save_handler,
     log_pre_delete_handler,
     log_pre_save_handler,
 )
-from simple_log.utils import get_model_list
+from simple_log.utils import (
+    clear_tracking_options,
+    clear_writer,
+    get_model_list,
+    get_tracking_options,
+    snapshot_on_load,
+)
 
 
 class SimpleLogConfig(AppConfig):
     name = 'simple_log'
     verbose_name = _('Logs')
     uid = 'simple_log.{}.{}'
-    m2m_uid = 'simple_log.{}.{}.{}'
 
     def register_signals(self, model):
         label = model._meta.label
@@ -35,28 +43,46 @@ class SimpleLogConfig(AppConfig):
             sender=label,
             dispatch_uid=self.uid.format('post_save', label),
         )
-        pre_delete.connect(
-            log_pre_delete_handler,
-            sender=label,
-            dispatch_uid=self.uid.format('pre_delete', label),
-        )
-        pre_delete.connect(
-            log_pre_delete_handler,
-            sender=label,
-            dispatch_uid=self.uid.format('post_delete', label),
-        )
+        if not settings.FAST_DELETE:
+            # Receivers disable fast delete, LogCollector logs deletes instead
+            pre_delete.connect(
+                log_pre_delete_handler,
+                sender=label,
+                dispatch_uid=self.uid.format('pre_delete', label),
+            )
+            pre_delete.connect(
+                log_pre_delete_handler,
+                sender=label,
+                dispatch_uid=self.uid.format('post_delete', label),
+            )
         for m2m in model._meta.many_to_many:
             sender = getattr(model, m2m.name).through
+            # Through model is shared by proxy models, connect handler once
             m2m_changed.connect(
                 log_m2m_change_handler,
                 sender=sender,
-                dispatch_uid=self.m2m_uid.format(
-                    'post_delete', sender._meta.label, label
+                dispatch_uid=self.uid.format(
+                    'm2m_changed', sender._meta.label
                 ),
             )
 
+    def register_snapshot(self, model):
+        if not getattr(model.from_db, 'simple_log_snapshot', False):
+            model.from_db = snapshot_on_load(model.from_db)
+
     def ready(self):
         if not simple_log.registered:
             for model in get_model_list():
                 self.register_signals(model)
+                self.register_snapshot(model)
+                get_tracking_options(model)
                 simple_log.registered = True
+        setting_changed.connect(clear_tracking_options)
+        setting_changed.connect(clear_writer)
+        # Content types and schemas may be recreated, e.g. on flush
+        post_migrate.connect(clear_tracking_options)
+        for name in ('SnapshotSchema', 'SnapshotBlob'):
+            post_migrate.connect(
+                self.get_model(name).clear_saved,
+                dispatch_uid=self.uid.format('post_migrate', name),
+            )
@@ -0,0 +1,165 @@
+from request_vars.utils import get_variable, set_variable
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+__all__ = ['LogBuffer']
+
+
+class Frame(object):
+    """
+    Logs, that are added in savepoint.
+    """
+
+    def __init__(self, sid, outer):
+        self.sid = sid
+        # Savepoints, that frame is nested in
+        self.outer = outer
+        # Previous logs of keys, ``None`` for new keys
+        self.previous = {}
+
+    def merge(self, frame):
+        for key, log in frame.previous.items():
+            self.previous.setdefault(key, log)
+
+
+class LogBuffer(object):
+    """
+    Logs of current transaction of database, keyed by logged instances.
+    Logs are saved by hook on commit, logs of rolled back savepoints and
+    transaction are dropped on next access and on commit. Buffer is added to
+    execute wrappers of connection, while it has frames, to catch rollbacks
+    to savepoints, because commit hooks are cleared before they are called.
+    """
+
+    def __init__(self, using):
+        self.using = using
+        self.logs = {}
+        # Position of hook in ``run_on_commit`` of connection. Hooks, that
+        # are registered before it, are discarded only with it, so position
+        # is kept until commit.
+        self.hook_index = None
+        self.frames = []
+        # Savepoints of frames by their rollback queries
+        self.savepoints = {}
+        self.rolled_back = set()
+
+    @classmethod
+    def get(cls, using=None, create=False):
+        """
+        :return: buffer of current transaction of database, ``None`` if
+            nothing is logged in transaction and ``create`` isn't set
+        """
+        using = using or DEFAULT_DB_ALIAS
+        buffers = get_variable('simple_log_buffers', {})
+        buffer = buffers.get(using)
+        if buffer is not None and not buffer.is_registered(
+            buffer.commit, buffer.hook_index
+        ):
+            # Hook is discarded with rolled back transaction
+            buffer.detach()
+            buffer = None
+        if buffer is not None:
+            buffer.sync()
+        elif create:
+            buffer = buffers[using] = cls(using)
+            set_variable('simple_log_buffers', buffers)
+        return buffer
+
+    @classmethod
+    def get_log(cls, key, using=None):
+        buffer = cls.get(using)
+        return buffer.logs.get(key) if buffer is not None else None
+
+    def get_savepoints(self):
+        return [x for x in connections[self.using].savepoint_ids if x]
+
+    def add(self, key, log):
+        savepoints = self.get_savepoints()
+        if savepoints and (
+            not self.frames or self.frames[-1].sid != savepoints[-1]
+        ):
+            self.frames.append(Frame(savepoints[-1], savepoints[:-1]))
+            self.watch(savepoints)
+        if self.frames:
+            self.frames[-1].previous.setdefault(key, self.logs.get(key))
+        self.logs[key] = log
+        if self.hook_index is None:
+            self.hook_index = self.register(self.commit)
+
+    def sync(self):
+        """
+        Drop logs of rolled back savepoints, logs of released savepoints are
+        moved to outer frame.
+        """
+        savepoints = self.get_savepoints()
+        while self.frames and self.frames[-1].sid not in savepoints:
+            frame = self.frames.pop()
+            if not self.rolled_back.isdisjoint([frame.sid] + frame.outer):
+                for key, log in frame.previous.items():
+                    if log is None:
+                        self.logs.pop(key, None)
+                    else:
+                        self.logs[key] = log
+                continue
+            outer = [x for x in frame.outer if x in savepoints]
+            parent = self.frames[-1] if self.frames else None
+            if outer and (
+                parent is None
+                or (parent.sid in savepoints and parent.sid != outer[-1])
+            ):
+                # Frame is rolled back with outer savepoint too
+                frame.sid, frame.outer = outer[-1], outer[:-1]
+                self.frames.append(frame)
+            elif parent is not None:
+                parent.merge(frame)
+
+    def register(self, hook):
+        """
+        :return: position of hook in ``run_on_commit`` of connection
+        """
+        connection = connections[self.using]
+        # Hook is called right away in autocommit mode
+        connection.on_commit(hook)
+        if connection.in_atomic_block:
+            return len(connection.run_on_commit) - 1
+
+    def is_registered(self, hook, index):
+        hooks = connections[self.using].run_on_commit
+        return (
+            index is not None
+            and index < len(hooks)
+            and hooks[index][1] == hook
+        )
+
+    def watch(self, savepoints):
+        connection = connections[self.using]
+        for sid in savepoints:
+            sql = connection.ops.savepoint_rollback_sql(sid)
+            self.savepoints[sql] = sid
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def __call__(self, execute, sql, params, many, context):
+        if not self.is_registered(self.commit, self.hook_index):
+            # Transaction is rolled back
+            self.detach()
+        elif sql in self.savepoints:
+            self.rolled_back.add(self.savepoints[sql])
+        return execute(sql, params, many, context)
+
+    def detach(self):
+        wrappers = connections[self.using].execute_wrappers
+        if self in wrappers:
+            wrappers.remove(self)
+        buffers = get_variable('simple_log_buffers', {})
+        if buffers.get(self.using) is self:
+            del buffers[self.using]
+
+    def commit(self):
+        from simple_log.signals import save_logs_on_commit
+
+        self.detach()
+        # Savepoints of transaction are exited
+        self.sync()
+        save_logs_on_commit(list(self.logs.values()))
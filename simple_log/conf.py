@@ -35,6 +35,21 @@ DEFAULTS = {
     'FILE_NAME_ONLY': True,
     'EXCLUDE_RAW': False,
     'ENABLED': True,
+    'BATCH_SIZE': 1000,
+    'SNAPSHOT_ON_LOAD': False,
+    'FK_REPR': 'instance',
+    'M2M_DELTA': False,
+    'DIFF_ONLY': False,
+    'CHECKPOINT_INTERVAL': None,
+    'COMPRESS': None,
+    'COMPRESS_THRESHOLD': 1024,
+    'SCHEMA_ENCODING': False,
+    'DEDUPLICATE': False,
+    'WRITER': 'simple_log.writers.DatabaseWriter',
+    'WRITER_OPTIONS': {},
+    'DATABASE': None,
+    'FAST_DELETE': False,
+    'POLICIES': {},
 }
 
 
@@ -68,7 +83,8 @@ class Settings(object):
         if enter:
             setattr(self, setting, value)
         else:
-            delattr(self, setting)
+            # Setting may be already cleared by nested override
+            self.__dict__.pop(setting, None)
 
 
 if not hasattr(dj_settings, 'SIMPLE_LOG_MODEL'):
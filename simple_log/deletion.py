@@ -0,0 +1,217 @@
+import copy
+
+from request_vars.utils import get_variable, set_variable
+
+import django
+from django.db import connections, router, transaction
+from django.db.models import prefetch_related_objects
+from django.db.models.deletion import Collector
+
+from simple_log.conf import settings
+from simple_log.utils import (
+    chunked,
+    get_log_model,
+    get_model_list,
+    get_obj_repr,
+    get_tracking_options,
+    is_log_needed,
+    prefetch_deferred,
+    prefetch_initial,
+    serialize_instances,
+)
+
+
+__all__ = [
+    'DeletedBatch',
+    'LogCollector',
+    'TrackedDeleteMixin',
+    'log_deleted',
+]
+
+
+def log_deleted(instances, using=None, origin=None):
+    """
+    Create delete logs of instances of one model, that are loaded from
+    database, with serializing them in bulk.
+
+    :param origin: object, that ``delete()`` is called on, it may be changed
+        after loading, so its initial state is fetched
+    """
+    log_model = get_log_model()
+    attr_name = settings.OLD_INSTANCE_ATTR_NAME
+    instances = [x for x in instances if is_log_needed(x, False, using)]
+    if not instances:
+        return
+    # Collector defers fields, that relations don't reference, if model has
+    # no delete receivers, e.g. with SIMPLE_LOG_FAST_DELETE
+    prefetch_deferred(instances, using)
+    parent_fields = get_tracking_options(
+        instances[0].__class__
+    ).parent_model_fields
+    if parent_fields:
+        # Parent objects are needed for parent logs
+        prefetch_related_objects(instances, *parent_fields)
+    prefetch_initial([x for x in instances if x is origin], using)
+    for instance in instances:
+        if not hasattr(instance, attr_name):
+            # Collector sets primary key of deleted instance to None, copy
+            # keeps it for related logs
+            setattr(instance, attr_name, copy.copy(instance))
+    values = serialize_instances(getattr(x, attr_name) for x in instances)
+    for instance, value in zip(instances, values):
+        instance._old_value = value
+        log_model.log(
+            instance=instance,
+            action_flag=log_model.DELETE,
+            commit=False,
+            object_repr=get_obj_repr(instance),
+            using=using,
+        )
+
+
+class DeletedBatch(object):
+    """
+    Instances of cascade, that ``pre_delete`` is sent for. Collector sends
+    ``pre_delete`` for all collected instances before deleting rows, so they
+    are logged together right before the next query of connection. Loaded
+    instances are used as initial state, relations are fetched in bulk.
+    Batch is dropped, if atomic block of delete is exited without queries,
+    e.g. ``pre_delete`` receiver raised exception.
+    """
+
+    def __init__(self, using, origin=None):
+        self.using = using
+        self.origin = origin
+        # Handler may be called for instance more than once
+        self.instances = {}
+        connection = connections[using]
+        self.hook_index = None
+        # Atomic block of delete is exited, when its savepoint is removed,
+        # even if rollback to outer savepoint is not executed yet
+        self.depth = len(connection.savepoint_ids)
+        if connection.in_atomic_block:
+            # Hook is discarded with rolled back transaction or savepoint
+            connection.on_commit(self.on_commit)
+            self.hook_index = len(connection.run_on_commit) - 1
+            connection.execute_wrappers.append(self)
+
+    @classmethod
+    def add(cls, instance, using=None, origin=None):
+        using = using or router.db_for_write(
+            instance.__class__, instance=instance
+        )
+        batches = get_variable('simple_log_deleted', {})
+        batch = batches.get(using)
+        if batch is not None and (
+            batch.origin is not origin or not batch.is_active()
+        ):
+            # Instances of other delete are logged, instances of rolled back
+            # delete are dropped
+            batch.flush()
+            batch = None
+        if batch is None:
+            batch = batches[using] = cls(using, origin)
+            set_variable('simple_log_deleted', batches)
+        batch.instances.setdefault(instance, instance)
+        if batch.hook_index is None:
+            # Signal is sent outside of atomic block
+            batch.flush()
+
+    def __call__(self, execute, sql, params, many, context):
+        self.flush()
+        return execute(sql, params, many, context)
+
+    def on_commit(self):
+        pass
+
+    def is_active(self):
+        """
+        :return: True if atomic block of delete isn't exited
+        """
+        connection = connections[self.using]
+        hooks = connection.run_on_commit
+        return self.hook_index is None or (
+            connection.in_atomic_block
+            and not connection.needs_rollback
+            and len(connection.savepoint_ids) >= self.depth
+            and self.hook_index < len(hooks)
+            and hooks[self.hook_index][1] == self.on_commit
+        )
+
+    def detach(self):
+        wrappers = connections[self.using].execute_wrappers
+        if self in wrappers:
+            wrappers.remove(self)
+        batches = get_variable('simple_log_deleted', {})
+        if batches.get(self.using) is self:
+            del batches[self.using]
+
+    def flush(self):
+        self.detach()
+        instances, self.instances = list(self.instances.values()), {}
+        if not instances or not self.is_active():
+            return
+        if self.origin is None:
+            # Origin isn't known, instances may be changed after loading
+            prefetch_initial(instances, self.using)
+        by_model = {}
+        for instance in instances:
+            by_model.setdefault(instance.__class__, []).append(instance)
+        for model_instances in by_model.values():
+            for chunk in chunked(model_instances, settings.BATCH_SIZE):
+                log_deleted(chunk, self.using, self.origin)
+
+
+class LogCollector(Collector):
+    """
+    Collector, that logs deleted objects of tracked models before deleting,
+    including rows of fast deleted querysets. Rows are fetched with chunked
+    queries, so fast delete of tracked models is kept.
+    """
+
+    def __init__(self, using, origin=None):
+        if django.VERSION < (4, 1):
+            # django < 4.1
+            super(LogCollector, self).__init__(using)
+            self.origin = origin
+        else:
+            super(LogCollector, self).__init__(using, origin=origin)
+
+    def delete(self):
+        if not settings.ENABLED or get_variable('disable_logging'):
+            return super(LogCollector, self).delete()
+        with transaction.atomic(using=self.using, savepoint=False):
+            self.log_deleted()
+            return super(LogCollector, self).delete()
+
+    def log_deleted(self):
+        model_list = get_model_list()
+        for model, instances in self.data.items():
+            if model in model_list:
+                log_deleted(instances, self.using, self.origin)
+        for qs in self.fast_deletes:
+            if qs.model in model_list:
+                for chunk in chunked(
+                    qs.iterator(chunk_size=settings.BATCH_SIZE),
+                    settings.BATCH_SIZE,
+                ):
+                    log_deleted(chunk, self.using)
+
+
+class TrackedDeleteMixin(object):
+    """
+    Model mixin, that deletes object with ``LogCollector``.
+    """
+
+    def delete(self, using=None, keep_parents=False):
+        if self.pk is None:
+            raise ValueError(
+                "%s object can't be deleted because its %s attribute is set "
+                'to None.' % (self._meta.object_name, self._meta.pk.attname)
+            )
+        using = using or router.db_for_write(self.__class__, instance=self)
+        collector = LogCollector(using=using, origin=self)
+        collector.collect([self], keep_parents=keep_parents)
+        return collector.delete()
+
+    delete.alters_data = True
@@ -1,4 +1,43 @@
+import base64
+import json
+import lzma
+import zlib
+
 from django.db.models import JSONField, ManyToManyField
+from django.db.models.query_utils import DeferredAttribute
+
+from simple_log.conf import settings
+
+
+COMPRESSORS = {
+    'zlib': (zlib.compress, zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+# Key of reference to ``SnapshotBlob``
+REF_KEY = '$ref'
+
+
+def is_ref(value):
+    return isinstance(value, dict) and len(value) == 1 and REF_KEY in value
+
+
+class SnapshotDescriptor(DeferredAttribute):
+    """
+    Load referenced ``SnapshotBlob`` on first access.
+    """
+
+    def __get__(self, instance, cls=None):
+        value = super(SnapshotDescriptor, self).__get__(instance, cls)
+        if instance is not None and is_ref(value):
+            from simple_log.models import SnapshotBlob
+
+            value = SnapshotBlob.load(value[REF_KEY], instance._state.db)
+            instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        # Data descriptor is called even if value is loaded
+        instance.__dict__[self.field.attname] = value
 
 
 class SimpleManyToManyField(ManyToManyField):
@@ -11,4 +50,57 @@ class SimpleManyToManyField(ManyToManyField):
 
 
 class SimpleJSONField(JSONField):
-    pass
+    """
+    JSON field, that saves values larger than ``COMPRESS_THRESHOLD`` bytes
+    compressed, if ``COMPRESS`` is set. Compressed values are stored as
+    ``{'$<compressor>': '<base64 data>'}`` and decoded on load.
+
+    With ``SCHEMA_ENCODING`` snapshots are saved as list of values with
+    version of ``SnapshotSchema``, they are encoded by log model before
+    insert. References to ``SnapshotBlob`` are loaded on access.
+    """
+
+    descriptor_class = SnapshotDescriptor
+
+    def pre_save(self, model_instance, add):
+        # Don't load referenced blob
+        value = model_instance.__dict__.get(self.attname)
+        if value is None:
+            value = super(SimpleJSONField, self).pre_save(model_instance, add)
+        return value
+
+    def get_db_prep_save(self, value, connection):
+        if settings.COMPRESS and isinstance(value, (dict, list)):
+            value = self.compress(value)
+        return super(SimpleJSONField, self).get_db_prep_save(value, connection)
+
+    def from_db_value(self, value, expression, connection):
+        value = super(SimpleJSONField, self).from_db_value(
+            value, expression, connection
+        )
+        value = self.decompress(value)
+        if isinstance(value, dict) and '$schema' in value:
+            from simple_log.models import SnapshotSchema
+
+            value = SnapshotSchema.decode(value, connection.alias)
+        return value
+
+    def compress(self, value):
+        data = json.dumps(
+            value, cls=self.encoder, separators=(',', ':')
+        ).encode()
+        if len(data) < settings.COMPRESS_THRESHOLD:
+            return value
+        compress = COMPRESSORS[settings.COMPRESS][0]
+        data = base64.b64encode(compress(data)).decode('ascii')
+        return {'$' + settings.COMPRESS: data}
+
+    def decompress(self, value):
+        if isinstance(value, dict) and len(value) == 1:
+            key, data = next(iter(value.items()))
+            if key[:1] == '$' and key[1:] in COMPRESSORS:
+                decompress = COMPRESSORS[key[1:]][1]
+                return json.loads(
+                    decompress(base64.b64decode(data)), cls=self.decoder
+                )
+        return value
@@ -0,0 +1,64 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from simple_log.conf import settings
+from simple_log.fields import is_ref
+from simple_log.models import SnapshotSchema
+from simple_log.utils import get_log_db, get_log_model
+
+
+class Command(BaseCommand):
+    help = (
+        'Save values of existing logs with current compression settings, '
+        'logs are decompressed if SIMPLE_LOG_COMPRESS is not set'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-b',
+            '--batch_size',
+            type=int,
+            default=settings.BATCH_SIZE,
+            help='Number of logs saved in one transaction',
+        )
+
+    def handle(self, *args, **options):
+        log_model = get_log_model()
+        db = get_log_db(log_model)
+        fields = ('old', 'new')
+        manager = log_model._default_manager.using(db)
+        # Content type is used by schema encoding
+        queryset = manager.order_by('pk').only(
+            'pk', log_model.content_type_field, 'old', 'new'
+        )
+        batch_size = options['batch_size']
+        count = 0
+        last_pk = None
+        while True:
+            chunk = queryset
+            if last_pk is not None:
+                chunk = chunk.filter(pk__gt=last_pk)
+            logs = list(chunk[:batch_size])
+            if not logs:
+                break
+            # Logs grouped by updated fields
+            updated = defaultdict(list)
+            for log in logs:
+                names = []
+                for name in fields:
+                    # References to deduplicated snapshots are kept, blobs
+                    # are not loaded
+                    if not is_ref(log.__dict__.get(name)):
+                        names.append(name)
+                if names:
+                    updated[tuple(names)].append(log)
+            with transaction.atomic(using=db), SnapshotSchema.encoded(
+                logs, db
+            ):
+                for names, field_logs in updated.items():
+                    manager.bulk_update(field_logs, names)
+            last_pk = logs[-1].pk
+            count += len(logs)
+        self.stdout.write('{} logs are saved'.format(count))
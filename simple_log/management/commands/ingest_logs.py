@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from simple_log.utils import get_writer
+from simple_log.writers import SpoolWriter
+
+
+class Command(BaseCommand):
+    help = (
+        'Save logs from spool segments to database, every segment is saved '
+        'in one transaction and deleted after commit'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-p',
+            '--path',
+            help='Spool directory, path of SpoolWriter is used by default',
+        )
+        parser.add_argument(
+            '-r',
+            '--rotate',
+            action='store_true',
+            help='Ingest logs of current spool file too',
+        )
+
+    def handle(self, *args, **options):
+        if options['path']:
+            writer = SpoolWriter(options['path'])
+        else:
+            writer = get_writer()
+            if not isinstance(writer, SpoolWriter):
+                raise CommandError(
+                    'SIMPLE_LOG_WRITER is not SpoolWriter, set --path'
+                )
+        if options['rotate']:
+            writer.rotate()
+        count = 0
+        segments = writer.get_segments()
+        for name in segments:
+            count += writer.ingest(name)
+        self.stdout.write(
+            '{} logs are saved from {} segments'.format(count, len(segments))
+        )
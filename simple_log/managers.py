@@ -0,0 +1,182 @@
+from request_vars.utils import get_variable
+
+import django
+from django.db import models, transaction
+
+from simple_log.buffer import LogBuffer
+from simple_log.conf import settings
+from simple_log.deletion import LogCollector
+from simple_log.utils import (
+    chunked,
+    disable_logging,
+    get_log_model,
+    get_model_list,
+    is_log_needed,
+    serialize_instances,
+)
+
+
+__all__ = ['TrackedQuerySetMixin', 'TrackedQuerySet', 'TrackedManager']
+
+
+class TrackedQuerySetMixin(object):
+    """
+    Log bulk operations, that don't send ``pre_save`` and ``post_save``
+    signals. Affected rows are fetched before and after operation with
+    chunked ``pk__in`` queries, logs are saved in bulk on commit. ``update``
+    changes rows, that match filters, when primary keys are fetched, add
+    ``select_for_update()`` to lock them until commit.
+    """
+
+    def is_tracked(self):
+        return (
+            settings.ENABLED
+            and not get_variable('disable_logging')
+            and self.model in get_model_list()
+        )
+
+    def update(self, **kwargs):
+        if not self.is_tracked():
+            return super(TrackedQuerySetMixin, self).update(**kwargs)
+        counts = []
+        with transaction.atomic(using=self.db, savepoint=False):
+            self.log_changes(
+                self.values_list('pk', flat=True),
+                lambda chunk: counts.append(
+                    super(TrackedQuerySetMixin, self.filter(pk__in=chunk))
+                    .update(**kwargs)
+                ),
+            )
+        return sum(counts)
+
+    update.alters_data = True
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        if not self.is_tracked():
+            return super(TrackedQuerySetMixin, self).bulk_update(
+                objs, fields, batch_size=batch_size
+            )
+        objs = {obj.pk: obj for obj in objs}
+        counts = []
+
+        def update(chunk):
+            # Update of chunk is logged here
+            with disable_logging():
+                counts.append(
+                    super(TrackedQuerySetMixin, self).bulk_update(
+                        [objs[x] for x in chunk], fields, batch_size
+                    )
+                )
+
+        with transaction.atomic(using=self.db, savepoint=False):
+            self.log_changes(objs.keys(), update)
+        return sum(counts)
+
+    bulk_update.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if not self.is_tracked():
+            return super(TrackedQuerySetMixin, self).bulk_create(
+                objs, *args, **kwargs
+            )
+        log_model = get_log_model()
+        with transaction.atomic(using=self.db, savepoint=False):
+            objs = super(TrackedQuerySetMixin, self).bulk_create(
+                objs, *args, **kwargs
+            )
+            for obj in objs:
+                # Primary key isn't set for ignored conflicts on some backends
+                if obj.pk is not None and is_log_needed(obj, False, self.db):
+                    log_model.log(
+                        instance=obj,
+                        action_flag=log_model.ADD,
+                        commit=False,
+                        using=self.db,
+                    )
+        return objs
+
+    bulk_create.alters_data = True
+
+    def delete(self):
+        if not self.is_tracked():
+            return super(TrackedQuerySetMixin, self).delete()
+        # Same as QuerySet.delete of Django 5.2, but deleted rows are logged
+        # by collector. Checks, that are added in later versions, are kept.
+        self._not_support_combined_queries('delete')
+        if self.query.is_sliced:
+            raise TypeError("Cannot use 'limit' or 'offset' with delete().")
+        if self.query.distinct_fields:
+            raise TypeError('Cannot call delete() after .distinct(*fields).')
+        if self._fields is not None:
+            raise TypeError(
+                'Cannot call delete() after .values() or .values_list()'
+            )
+        del_query = self._chain()
+        # The delete is actually 2 queries - one to find related objects,
+        # and one to delete. Make sure that the discovery of related
+        # objects is performed on the same database as the deletion.
+        del_query._for_write = True
+        # Disable non-supported fields.
+        del_query.query.select_for_update = False
+        del_query.query.select_related = False
+        if django.VERSION < (4, 0):
+            # django < 4.0
+            del_query.query.clear_ordering(force_empty=True)
+        else:
+            del_query.query.clear_ordering(force=True)
+        collector = LogCollector(using=del_query.db, origin=self)
+        collector.collect(del_query)
+        deleted = collector.delete()
+        self._result_cache = None
+        return deleted
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def log_changes(self, pks, update):
+        """
+        Call ``update`` for chunks of primary keys and log changes of rows.
+
+        :param pks: primary keys of changed rows
+        :param update: function, that updates rows of chunk
+        """
+        log_model = get_log_model()
+        manager = self.model._base_manager.using(self.db)
+        attr_name = settings.OLD_INSTANCE_ATTR_NAME
+        for chunk in chunked(list(pks), settings.BATCH_SIZE):
+            old_instances = manager.in_bulk(chunk)
+            old_values = dict(
+                zip(
+                    old_instances,
+                    serialize_instances(old_instances.values()),
+                )
+            )
+            update(chunk)
+            for pk, instance in manager.in_bulk(chunk).items():
+                log = LogBuffer.get_log(instance, self.db)
+                if log is not None and not log.is_delete:
+                    # Logged in transaction, keep its initial state
+                    for name in (attr_name, '_old_value'):
+                        if hasattr(log.instance, name):
+                            setattr(
+                                instance, name, getattr(log.instance, name)
+                            )
+                    log.instance = instance
+                    continue
+                if not is_log_needed(instance, False, self.db):
+                    continue
+                setattr(instance, attr_name, old_instances.get(pk))
+                instance._old_value = old_values.get(pk)
+                log_model.log(
+                    instance=instance,
+                    action_flag=log_model.CHANGE,
+                    commit=False,
+                    using=self.db,
+                )
+
+
+class TrackedQuerySet(TrackedQuerySetMixin, models.QuerySet):
+    pass
+
+
+TrackedManager = models.Manager.from_queryset(TrackedQuerySet)
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('simple_log', '0004_auto_20180614_0727'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnapshotSchema',
+            fields=[
+                (
+                    'version',
+                    models.CharField(
+                        editable=False,
+                        max_length=40,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='version',
+                    ),
+                ),
+                ('fields', models.JSONField(verbose_name='fields')),
+                (
+                    'content_type',
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to='contenttypes.contenttype',
+                        verbose_name='content type',
+                    ),
+                ),
+            ],
+            options={
+                'verbose_name': 'snapshot schema',
+                'verbose_name_plural': 'snapshot schemas',
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:49
+
+import django.db.models.deletion
+import simple_log.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('simple_log', '0005_snapshotschema'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnapshotBlob',
+            fields=[
+                (
+                    'hash',
+                    models.CharField(
+                        editable=False,
+                        max_length=40,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='hash',
+                    ),
+                ),
+                (
+                    'data',
+                    simple_log.fields.SimpleJSONField(verbose_name='data'),
+                ),
+                (
+                    'content_type',
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to='contenttypes.contenttype',
+                        verbose_name='content type',
+                    ),
+                ),
+            ],
+            options={
+                'verbose_name': 'snapshot blob',
+                'verbose_name_plural': 'snapshot blobs',
+            },
+        ),
+    ]
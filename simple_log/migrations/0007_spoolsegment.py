@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:56
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simple_log', '0006_snapshotblob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpoolSegment',
+            fields=[
+                (
+                    'name',
+                    models.CharField(
+                        editable=False,
+                        max_length=255,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='name',
+                    ),
+                ),
+                (
+                    'ingest_time',
+                    models.DateTimeField(
+                        default=django.utils.timezone.now,
+                        editable=False,
+                        verbose_name='ingest time',
+                    ),
+                ),
+            ],
+            options={
+                'verbose_name': 'spool segment',
+                'verbose_name_plural': 'spool segments',
+            },
+        ),
+    ]
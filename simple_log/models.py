@@ -1,30 +1,49 @@
 import datetime
+import hashlib
+import json
 import logging
 import os
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import lru_cache
 
-from request_vars.utils import del_variable, get_variable, set_variable
+from request_vars.utils import get_variable
 
 from django.conf import settings as django_settings
 from django.contrib.admin.utils import quote
+from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_ipv46_address
-from django.db import connection, models
+from django.db import connections, models, transaction
 from django.urls import NoReverseMatch, reverse
 from django.utils import timezone
 from django.utils.encoding import force_str
-from django.utils.functional import cached_property
+from django.utils.functional import Promise, cached_property
 from django.utils.translation import gettext_lazy as _
 
-from simple_log.fields import SimpleJSONField, SimpleManyToManyField
-from simple_log.signals import save_logs_on_commit
+from simple_log.buffer import LogBuffer
+from simple_log.fields import (
+    REF_KEY,
+    SimpleJSONField,
+    SimpleManyToManyField,
+    is_ref,
+)
 
 from .conf import settings
 from .utils import (
+    M2M_DELTA_KEY,
+    M2M_REMOVED_ATTR_NAME,
+    RELATIONS_ATTR_NAME,
+    SNAPSHOT_ATTR_NAME,
+    DeferredRepr,
+    chunked,
     get_current_request,
     get_current_user,
-    get_fields,
+    get_instance_db,
+    get_log_db,
     get_obj_repr,
+    get_tracking_options,
     serialize_instance,
 )
 
@@ -32,13 +51,20 @@ from .utils import (
 __all__ = [
     'SimpleLogAbstractBase',
     'SimpleLogAbstract',
+    'SimpleLogPlainAbstract',
     'SimpleLog',
     'ModelSerializer',
+    'SnapshotSchema',
+    'SnapshotBlob',
+    'SpoolSegment',
 ]
 
 
 logger = logging.getLogger('simple_log')
 
+# Key of values, that are saved in diff only format
+DIFF_KEY = '$diff'
+
 
 class SimpleLogAbstractBase(models.Model):
     ADD = 1
@@ -49,6 +75,13 @@ class SimpleLogAbstractBase(models.Model):
         (CHANGE, _('changed')),
         (DELETE, _('deleted')),
     )
+    # Field name -> (label, added items, removed items) for m2m delta logs
+    m2m_delta = None
+    # Log keeps full values in diff only format
+    checkpoint = None
+    # Field, that keeps content type of edited object
+    content_type_field = 'content_type'
+
     action_time = models.DateTimeField(
         _('action time'), default=timezone.now, editable=False
     )
@@ -94,6 +127,17 @@ class SimpleLogAbstractBase(models.Model):
         return getattr(self, '_related_objects', [])
 
     def save(self, *args, **kwargs):
+        if kwargs.get('using') is None:
+            kwargs['using'] = get_log_db(self.__class__)
+        if self.pk is None and self.checkpoint is None:
+            self.mark_checkpoints([self], kwargs.get('using'))
+        self.prepare_values()
+        with SnapshotSchema.encoded(
+            [self], kwargs.get('using')
+        ), SnapshotBlob.references([self], kwargs.get('using')):
+            super(SimpleLogAbstractBase, self).save(*args, **kwargs)
+
+    def prepare_values(self):
         if settings.SAVE_ONLY_CHANGED:
             changed = self.changed_fields.keys()
             self.old = {
@@ -102,7 +146,112 @@ class SimpleLogAbstractBase(models.Model):
             self.new = {
                 k: v for k, v in (self.new or {}).items() if k in changed
             } or None
-        super(SimpleLogAbstractBase, self).save(*args, **kwargs)
+        if (
+            settings.DIFF_ONLY
+            and self.is_change
+            and not self.checkpoint
+            and self.old
+            and self.new
+            and DIFF_KEY not in self.new
+        ):
+            self.old, self.new = None, {
+                DIFF_KEY: {
+                    k: [
+                        label,
+                        self.old.get(k, {}).get('value'),
+                        self.new.get(k, {}).get('value'),
+                    ]
+                    for k, label in self.changed_fields.items()
+                }
+            }
+
+    @classmethod
+    def mark_checkpoints(cls, logs, using=None):
+        """
+        Mark every ``CHECKPOINT_INTERVAL`` log of object as checkpoint, that
+        keeps full values if ``DIFF_ONLY`` is enabled.
+        """
+        if not (settings.DIFF_ONLY and settings.CHECKPOINT_INTERVAL):
+            return
+        attname = cls._meta.get_field(cls.content_type_field).attname
+        by_type = defaultdict(list)
+        for log in logs:
+            by_type[getattr(log, attname)].append(log)
+        for content_type, type_logs in by_type.items():
+            counts = {}
+            object_ids = {force_str(x.object_id) for x in type_logs}
+            for chunk in chunked(object_ids, settings.BATCH_SIZE):
+                counts.update(
+                    cls._default_manager.using(using)
+                    .filter(**{attname: content_type, 'object_id__in': chunk})
+                    .order_by()
+                    .values_list('object_id')
+                    .annotate(count=models.Count('pk'))
+                )
+            for log in type_logs:
+                key = force_str(log.object_id)
+                counts[key] = counts.get(key, 0) + 1
+                log.checkpoint = (
+                    counts[key] % settings.CHECKPOINT_INTERVAL == 0
+                )
+
+    def get_snapshots(self):
+        """
+        :return: old and new values, decoded from storage format
+        """
+        diff = (self.new or {}).get(DIFF_KEY)
+        if diff is None:
+            return self.old, self.new
+        return (
+            {k: {'label': v[0], 'value': v[1]} for k, v in diff.items()},
+            {k: {'label': v[0], 'value': v[2]} for k, v in diff.items()},
+        )
+
+    @classmethod
+    def bulk_save(cls, logs):
+        db = get_log_db(cls)
+        cls.mark_checkpoints(logs, db)
+        if not connections[db].features.can_return_rows_from_bulk_insert:
+            # Primary keys are needed for linking related logs
+            for log in logs:
+                log.save(using=db)
+            return
+        for log in logs:
+            log.prepare_values()
+        with SnapshotSchema.encoded(logs, db), SnapshotBlob.references(
+            logs, db
+        ):
+            cls._default_manager.using(db).bulk_create(
+                logs, batch_size=settings.BATCH_SIZE
+            )
+
+    @classmethod
+    def bulk_save_related(cls, related_logs):
+        """
+        :param related_logs: list of tuples (log, list of its related logs)
+        """
+        field = cls._meta.get_field('related_logs')
+        through = field.remote_field.through
+        from_attname = through._meta.get_field(field.m2m_field_name()).attname
+        to_attname = through._meta.get_field(
+            field.m2m_reverse_field_name()
+        ).attname
+        through._default_manager.using(get_log_db(cls)).bulk_create(
+            [
+                through(**{from_attname: log.pk, to_attname: related_log.pk})
+                for log, related in related_logs
+                for related_log in related
+            ],
+            batch_size=settings.BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+
+    @classmethod
+    def get_content_type_filter(cls, content_type):
+        """
+        :return: lookup of logs of objects with content type
+        """
+        return {'content_type': content_type}
 
     def get_edited_object(self):
         return self.content_type.get_object_for_this_type(pk=self.object_id)
@@ -126,14 +275,9 @@ class SimpleLogAbstractBase(models.Model):
         else:
             user = get_current_user()
         params = {
-            'content_type': ContentType.objects.get_for_model(
-                instance.__class__,
-                for_concrete_model=getattr(
-                    instance,
-                    'simple_log_proxy_concrete',
-                    settings.PROXY_CONCRETE,
-                ),
-            ),
+            'content_type': get_tracking_options(
+                instance.__class__
+            ).content_type,
             'object_id': instance.pk,
             'object_repr': get_obj_repr(instance),
             'user': user if user and user.is_authenticated else None,
@@ -145,20 +289,29 @@ class SimpleLogAbstractBase(models.Model):
         return params
 
     @classmethod
-    def add_to_thread(cls, instance, obj):
-        in_commit = save_logs_on_commit in [
-            f[1] for f in connection.run_on_commit
-        ]
-        instances = get_variable('simple_log_instances', {})
-        # prevent memory usage in non transaction test cases
-        if not in_commit and instances:
-            del_variable('simple_log_instances')
-            instances = {}
-        instances[instance] = obj
-        set_variable('simple_log_instances', instances)
+    def add_to_thread(cls, instance, obj, using=None):
+        """
+        Add log to buffer of transaction of database, that instance is
+        written to.
+        """
+        LogBuffer.get(using, create=True).add(instance, obj)
 
-        if not in_commit:
-            connection.on_commit(save_logs_on_commit)
+    @classmethod
+    def get_initial_instance(cls, instance, using=None):
+        snapshot = instance.__dict__.pop(SNAPSHOT_ATTR_NAME, None)
+        if snapshot and settings.SNAPSHOT_ON_LOAD:
+            db, field_names, values = snapshot
+            if using is None or using == db:
+                old_instance = instance.__class__.from_db(
+                    db, field_names, values
+                )
+                if old_instance.pk == instance.pk:
+                    return old_instance
+        return (
+            instance.__class__._base_manager.using(using)
+            .filter(pk=instance.pk)
+            .first()
+        )
 
     @classmethod
     def set_initial(cls, instance, using=None):
@@ -168,9 +321,7 @@ class SimpleLogAbstractBase(models.Model):
             setattr(
                 instance,
                 settings.OLD_INSTANCE_ATTR_NAME,
-                instance.__class__._base_manager.using(using)
-                .filter(pk=instance.pk)
-                .first(),
+                cls.get_initial_instance(instance, using),
             )
         if not hasattr(instance, '_old_values'):
             old_instance = getattr(
@@ -196,21 +347,140 @@ class SimpleLogAbstractBase(models.Model):
             instance._log = obj
             obj.force_save = force_save
             obj.disable_related = get_variable('disable_related', False)
-            if hasattr(instance, 'parent_model_fields'):
+            if get_tracking_options(instance.__class__).parent_model_fields:
                 obj.create_parent_logs()
             if commit:
                 obj.save()
-            cls.add_to_thread(instance, obj)
+            cls.add_to_thread(instance, obj, get_instance_db(instance, using))
             return obj
         except Exception:
             logger.exception("Can't create log instance.")
 
+    @classmethod
+    def log_m2m_delta(cls, instance, field, action, pk_set):
+        """
+        Add change of m2m field to log of instance, that keeps only added
+        and removed items of fields.
+
+        :return: False if changes of field can't be logged as delta
+        """
+        serializer = get_tracking_options(instance.__class__).serializer
+        if not serializer.has_default_value(field):
+            return False
+        manager = getattr(instance, field.name)
+        lookup = field.m2m_target_field_name() + '__in'
+        removing = instance.__dict__.setdefault(M2M_REMOVED_ATTR_NAME, {})
+        if action == 'pre_remove':
+            removing[field.name] = list(manager.filter(**{lookup: pk_set}))
+        elif action == 'pre_clear':
+            removing[field.name] = list(manager.all())
+        elif action == 'post_add':
+            cls.add_m2m_delta(
+                instance, field, list(manager.filter(**{lookup: pk_set})), []
+            )
+        elif action in ('post_remove', 'post_clear'):
+            cls.add_m2m_delta(
+                instance, field, [], removing.pop(field.name, [])
+            )
+        return True
+
+    @classmethod
+    def add_m2m_delta(cls, instance, field, added, removed):
+        key = (instance, M2M_DELTA_KEY)
+        using = get_instance_db(instance)
+        log = LogBuffer.get_log(key, using)
+        if log is None:
+            log = cls(**cls.get_log_params(instance, action_flag=cls.CHANGE))
+            log.instance = instance
+            log.m2m_delta = {}
+            log.disable_related = get_variable('disable_related', False)
+            instance._log = log
+            if get_tracking_options(instance.__class__).parent_model_fields:
+                log.create_parent_logs()
+            cls.add_to_thread(key, log, using)
+        serializer = get_tracking_options(instance.__class__).serializer
+        if field.name not in log.m2m_delta:
+            log.m2m_delta[field.name] = (
+                serializer.get_label_getter(field)(),
+                {},
+                {},
+            )
+        _, added_items, removed_items = log.m2m_delta[field.name]
+        for objects, items, opposite in (
+            (added, added_items, removed_items),
+            (removed, removed_items, added_items),
+        ):
+            for obj in objects:
+                value = serializer.get_related_value(obj)
+                if opposite.pop(value['db'], None) is None:
+                    items[value['db']] = value
+
+    @classmethod
+    def set_m2m_delta_values(cls, logs):
+        """
+        Set old and new values of logs of m2m changes. Current values of
+        changed fields are fetched for all logs of model at once, old values
+        are restored from added and removed items.
+        """
+        by_class = defaultdict(list)
+        for log in logs:
+            by_class[log.instance.__class__].append(log)
+        for klass, class_logs in by_class.items():
+            serializer = get_tracking_options(klass).serializer
+            instances = [x.instance for x in class_logs]
+            try:
+                try:
+                    serializer.prefetch_relations(
+                        instances, {y for x in class_logs for y in x.m2m_delta}
+                    )
+                except Exception:
+                    logger.exception("Can't prefetch relations of %s", klass)
+                for log in class_logs:
+                    log.old, log.new = log.get_m2m_delta_values()
+            finally:
+                for instance in instances:
+                    instance.__dict__.pop(RELATIONS_ATTR_NAME, None)
+
+    def get_m2m_delta_values(self):
+        """
+        :return: old and new values of changed m2m fields
+        """
+        serializer = get_tracking_options(self.instance.__class__).serializer
+        old, new = {}, {}
+        for name, (label, added, removed) in self.m2m_delta.items():
+            if added or removed:
+                value = serializer.get_m2m_value(
+                    self.instance, self.instance._meta.get_field(name)
+                )
+                old_value = [x for x in value if x['db'] not in added]
+                old_value.extend(removed.values())
+                old[name] = {'label': label, 'value': old_value}
+                new[name] = {'label': label, 'value': value}
+        return old or None, new or None
+
+    def merge_m2m_delta(self, m2m_delta):
+        """
+        Restore old values of m2m fields, that were changed in delta mode
+        before initial state of instance was taken.
+        """
+        if not self.old:
+            return
+        self.old = dict(self.old)
+        for name, (_label, added, removed) in m2m_delta.items():
+            item = self.old.get(name)
+            if item is not None and (added or removed):
+                value = [x for x in item['value'] if x['db'] not in added]
+                value.extend(removed.values())
+                self.old[name] = dict(item, value=value)
+
     def create_parent_logs(self):
-        new_instances = get_variable('simple_log_instances', {})
-        for field in self.instance.parent_model_fields:
+        options = get_tracking_options(self.instance.__class__)
+        for field in options.parent_model_fields:
             parent_instance = getattr(self.instance, field, None)
             if parent_instance:
-                parent_log = new_instances.get(parent_instance)
+                parent_log = LogBuffer.get_log(
+                    parent_instance, get_instance_db(parent_instance)
+                )
                 if not parent_log:
                     parent_log = self.log(
                         parent_instance,
@@ -224,8 +494,9 @@ class SimpleLogAbstractBase(models.Model):
 
     @cached_property
     def changed_fields(self):
-        old = self.old or {}
-        new = self.new or {}
+        old, new = self.get_snapshots()
+        old = old or {}
+        new = new or {}
         vals = old or new
         return {
             k: vals[k]['label']
@@ -240,8 +511,9 @@ class SimpleLogAbstractBase(models.Model):
             - list with added items
             - list with removed items
         """
-        old = (self.old or {}).get(field_name, {}).get('value', [])
-        new = (self.new or {}).get(field_name, {}).get('value', [])
+        old, new = self.get_snapshots()
+        old = (old or {}).get(field_name, {}).get('value', [])
+        new = (new or {}).get(field_name, {}).get('value', [])
         return (
             [x for x in new if x not in old],
             [x for x in old if x not in new],
@@ -272,8 +544,9 @@ class SimpleLogAbstractBase(models.Model):
             return settings.ANONYMOUS_REPR
 
     def get_differences(self):
-        old = self.old or {}
-        new = self.new or {}
+        old, new = self.get_snapshots()
+        old = old or {}
+        new = new or {}
         return [
             {
                 'label': value,
@@ -298,12 +571,342 @@ class SimpleLogAbstract(SimpleLogAbstractBase):
         )
 
 
+class SimpleLogPlainAbstract(SimpleLogAbstract):
+    """
+    Log without foreign keys, that can be saved to another database with
+    ``DATABASE`` setting. Content type is saved as label of model, user as
+    primary key.
+    """
+
+    content_type_label = models.CharField(
+        _('content type'), max_length=255, blank=True, db_index=True
+    )
+    user_id = models.TextField(_('user id'), blank=True, null=True)
+
+    content_type_field = 'content_type_label'
+
+    class Meta(SimpleLogAbstract.Meta):
+        abstract = True
+
+    @property
+    def content_type(self):
+        if not self.content_type_label:
+            return None
+        try:
+            return ContentType.objects.get_by_natural_key(
+                *self.content_type_label.split('.', 1)
+            )
+        except ContentType.DoesNotExist:
+            return None
+
+    @content_type.setter
+    def content_type(self, value):
+        self.content_type_label = (
+            '.'.join(value.natural_key()) if value else ''
+        )
+
+    @property
+    def user(self):
+        if self.user_id is None:
+            return None
+        return (
+            get_user_model()._default_manager.filter(pk=self.user_id).first()
+        )
+
+    @user.setter
+    def user(self, value):
+        self.user_id = force_str(value.pk) if value else None
+
+    @classmethod
+    def get_content_type_filter(cls, content_type):
+        return {'content_type_label': '.'.join(content_type.natural_key())}
+
+
 class SimpleLog(SimpleLogAbstract):
     class Meta(SimpleLogAbstract.Meta):
         swappable = 'SIMPLE_LOG_MODEL'
 
 
+class SnapshotSchema(models.Model):
+    """
+    Field names, labels and kinds of values of snapshots, that are saved as
+    list of values with ``SCHEMA_ENCODING`` enabled. Version is a hash of
+    model and fields, so schema is saved once.
+    """
+
+    PLAIN = 0
+    PAIR = 1
+    PAIRS = 2
+
+    version = models.CharField(
+        _('version'), max_length=40, primary_key=True, editable=False
+    )
+    content_type = models.ForeignKey(
+        ContentType,
+        on_delete=models.SET_NULL,
+        verbose_name=_('content type'),
+        blank=True,
+        null=True,
+    )
+    fields = models.JSONField(_('fields'))
+
+    # (database, content type id, fields) -> version of saved schemas
+    saved = {}
+
+    class Meta:
+        verbose_name = _('snapshot schema')
+        verbose_name_plural = _('snapshot schemas')
+
+    def __str__(self):
+        return self.version
+
+    @classmethod
+    @contextmanager
+    def encoded(cls, logs, using=None):
+        """
+        Save schemas of old and new values of logs with one query and replace
+        values with encoded ones while logs are saved.
+        """
+        if not settings.SCHEMA_ENCODING:
+            yield
+            return
+        replaced, schemas = [], {}
+        for log in logs:
+            for name in ('old', 'new'):
+                value = log.__dict__.get(name)
+                if not isinstance(value, dict) or is_ref(value):
+                    continue
+                encoded = cls.encode(
+                    value,
+                    # Log model may have no foreign key to content type
+                    log.__dict__.get('content_type_id'),
+                    schemas,
+                    using,
+                )
+                if encoded is not value:
+                    replaced.append((log, name, value))
+                    log.__dict__[name] = encoded
+        try:
+            if schemas:
+                cls._default_manager.using(using).bulk_create(
+                    schemas.values(),
+                    batch_size=settings.BATCH_SIZE,
+                    ignore_conflicts=True,
+                )
+                # Schemas may be rolled back with transaction
+                transaction.on_commit(
+                    lambda: cls.remember(schemas, using), using=using
+                )
+            yield
+        finally:
+            for log, name, value in replaced:
+                log.__dict__[name] = value
+
+    @classmethod
+    def encode(cls, values, content_type_id, schemas, using=None):
+        """
+        :param schemas: dict, that schemas of values, that aren't saved to
+            database, are added to
+        :return: dict with schema version and list of values or values as
+            is, if they are not snapshot
+        """
+        fields, encoded = [], []
+        for name, item in values.items():
+            if name[:1] == '$' or not (
+                isinstance(item, dict) and item.keys() == {'label', 'value'}
+            ):
+                return values
+            kind, value = cls.encode_value(item['value'])
+            fields.append((name, item['label'], kind))
+            encoded.append(value)
+        key = (content_type_id, tuple(fields))
+        version = cls.saved.get((using,) + key)
+        if version is None:
+            version = hashlib.sha1(json.dumps(key).encode()).hexdigest()
+            schemas[key] = cls(
+                version=version,
+                content_type_id=content_type_id,
+                fields=key[1],
+            )
+        return {'$schema': version, '$values': encoded}
+
+    @classmethod
+    def encode_value(cls, value):
+        if isinstance(value, dict) and value.keys() == {'db', 'repr'}:
+            return cls.PAIR, [value['db'], value['repr']]
+        if isinstance(value, list) and all(
+            isinstance(x, dict) and x.keys() == {'db', 'repr'} for x in value
+        ):
+            return cls.PAIRS, [[x['db'], x['repr']] for x in value]
+        return cls.PLAIN, value
+
+    @classmethod
+    def decode(cls, values, using=None):
+        fields = get_schema_fields(values['$schema'], using)
+        return {
+            name: {'label': label, 'value': cls.decode_value(kind, value)}
+            for (name, label, kind), value in zip(fields, values['$values'])
+        }
+
+    @classmethod
+    def decode_value(cls, kind, value):
+        if kind == cls.PAIR:
+            return {'db': value[0], 'repr': value[1]}
+        if kind == cls.PAIRS:
+            return [{'db': x[0], 'repr': x[1]} for x in value]
+        return value
+
+    @classmethod
+    def remember(cls, schemas, using=None):
+        cls.saved.update(((using,) + k, v.version) for k, v in schemas.items())
+
+    @classmethod
+    def clear_saved(cls, **kwargs):
+        cls.saved.clear()
+
+
+@lru_cache(maxsize=None)
+def get_schema_fields(version, using=None):
+    return SnapshotSchema._default_manager.using(using).get(pk=version).fields
+
+
+class SnapshotBlob(models.Model):
+    """
+    Snapshot, that is saved once and referenced by hash from old and new
+    values of logs with ``DEDUPLICATE`` enabled.
+    """
+
+    hash = models.CharField(
+        _('hash'), max_length=40, primary_key=True, editable=False
+    )
+    content_type = models.ForeignKey(
+        ContentType,
+        on_delete=models.SET_NULL,
+        verbose_name=_('content type'),
+        blank=True,
+        null=True,
+    )
+    data = SimpleJSONField(_('data'))
+
+    # Hashes of saved blobs, cleared if limit is reached
+    saved = set()
+    saved_limit = 100000
+
+    class Meta:
+        verbose_name = _('snapshot blob')
+        verbose_name_plural = _('snapshot blobs')
+
+    def __str__(self):
+        return self.hash
+
+    @staticmethod
+    def get_hash(value):
+        return hashlib.sha1(
+            json.dumps(value, sort_keys=True, separators=(',', ':')).encode()
+        ).hexdigest()
+
+    @classmethod
+    @contextmanager
+    def references(cls, logs, using=None):
+        """
+        Save old and new values of logs as blobs with one query and replace
+        them with references while logs are saved.
+        """
+        if not settings.DEDUPLICATE:
+            yield
+            return
+        replaced, blobs = [], {}
+        for log in logs:
+            for name in ('old', 'new'):
+                value = log.__dict__.get(name)
+                if value is None or is_ref(value):
+                    continue
+                digest = cls.get_hash(value)
+                if digest not in cls.saved and digest not in blobs:
+                    blobs[digest] = cls(
+                        hash=digest,
+                        content_type_id=log.__dict__.get('content_type_id'),
+                        data=value,
+                    )
+                replaced.append((log, name, value))
+                log.__dict__[name] = {REF_KEY: digest}
+        try:
+            if blobs:
+                cls._default_manager.using(using).bulk_create(
+                    blobs.values(),
+                    batch_size=settings.BATCH_SIZE,
+                    ignore_conflicts=True,
+                )
+                # Blobs may be rolled back with transaction
+                transaction.on_commit(
+                    lambda: cls.remember(blobs), using=using
+                )
+            yield
+        finally:
+            for log, name, value in replaced:
+                log.__dict__[name] = value
+
+    @classmethod
+    def remember(cls, hashes):
+        if len(cls.saved) > cls.saved_limit:
+            cls.saved.clear()
+        cls.saved.update(hashes)
+
+    @classmethod
+    def clear_saved(cls, **kwargs):
+        cls.saved.clear()
+
+    @classmethod
+    def load(cls, digest, using=None):
+        return cls._default_manager.using(using).get(pk=digest).data
+
+    @classmethod
+    def prefetch(cls, logs, using=None):
+        """
+        Load referenced values of logs with one query.
+
+        :return: list of logs
+        """
+        logs = list(logs)
+        refs = defaultdict(list)
+        for log in logs:
+            for name in ('old', 'new'):
+                value = log.__dict__.get(name)
+                if is_ref(value):
+                    refs[value[REF_KEY]].append((log, name))
+        for chunk in chunked(refs, settings.BATCH_SIZE):
+            for blob in cls._default_manager.using(using).filter(
+                pk__in=chunk
+            ):
+                for log, name in refs[blob.hash]:
+                    log.__dict__[name] = blob.data
+        return logs
+
+
+class SpoolSegment(models.Model):
+    """
+    Spool segment, that is ingested in the same transaction as its logs.
+    Ingested segment is skipped if it wasn't deleted, e.g. on restart.
+    """
+
+    name = models.CharField(
+        _('name'), max_length=255, primary_key=True, editable=False
+    )
+    ingest_time = models.DateTimeField(
+        _('ingest time'), default=timezone.now, editable=False
+    )
+
+    class Meta:
+        verbose_name = _('spool segment')
+        verbose_name_plural = _('spool segments')
+
+    def __str__(self):
+        return self.name
+
+
 class ModelSerializer(object):
+    plain_types = frozenset((str, int, bool, dict, list))
+
     def __call__(self, instance):
         return self.serialize(instance)
 
@@ -311,49 +914,221 @@ class ModelSerializer(object):
         if not (instance and instance.pk):
             return None
         return {
-            field.name: {
-                'label': self.get_field_label(field),
-                'value': self.get_field_value(instance, field),
-            }
-            for field in get_fields(instance.__class__)
+            name: {'label': get_label(), 'value': get_value(instance)}
+            for name, get_label, get_value in self.get_plan(
+                instance.__class__
+            )
         }
 
+    def get_plan(self, model):
+        """
+        :return: list of tuples (field name, function that returns label,
+            function that returns value of field for instance), built once
+            for model
+        """
+        plans = self.__dict__.setdefault('_plans', {})
+        if model not in plans:
+            plans[model] = [
+                (
+                    field.name,
+                    self.get_label_getter(field),
+                    self.get_value_getter(field),
+                )
+                for field in get_tracking_options(model).fields
+            ]
+        return plans[model]
+
+    def is_default(self, name):
+        return getattr(self.__class__, name) is getattr(ModelSerializer, name)
+
+    def get_label_getter(self, field):
+        if not self.is_default('get_field_label'):
+            return lambda: self.get_field_label(field)
+        if field.one_to_many:
+            label = field.related_model._meta.verbose_name_plural
+        else:
+            label = field.verbose_name
+        if isinstance(label, Promise):
+            # Translate on every call, language may change
+            return lambda: force_str(label)
+        label = force_str(label)
+        return lambda: label
+
+    def get_value_getter(self, field):
+        if not self.is_default('get_field_value'):
+            return lambda instance: self.get_field_value(instance, field)
+        method = self.get_value_method(field)
+        if (
+            method.__func__ is ModelSerializer.get_other_value
+            and self.is_default('get_value_for_type')
+            and field.__class__.value_from_object
+            is models.Field.value_from_object
+        ):
+            attname = field.attname
+            get_value_for_type = self.get_value_for_type
+            return lambda instance: get_value_for_type(
+                getattr(instance, attname)
+            )
+        return lambda instance: method(instance, field)
+
     def get_field_label(self, field):
         if field.one_to_many:
             return force_str(field.related_model._meta.verbose_name_plural)
         return force_str(field.verbose_name)
 
-    def get_field_value(self, instance, field):
+    def get_value_method(self, field):
         if field.many_to_many:
-            return self.get_m2m_value(instance, field)
+            return self.get_m2m_value
         elif field.one_to_many:
-            return self.get_o2m_value(instance, field)
+            return self.get_o2m_value
         elif field.is_relation:
-            return self.get_fk_value(instance, field)
+            return self.get_fk_value
         elif getattr(field, 'choices', None):
-            return self.get_choice_value(instance, field)
+            return self.get_choice_value
         elif isinstance(field, models.FileField):
-            return self.get_file_value(instance, field)
-        return self.get_other_value(instance, field)
+            return self.get_file_value
+        return self.get_other_value
+
+    def get_field_value(self, instance, field):
+        return self.get_value_method(field)(instance, field)
+
+    def has_default_value(self, field):
+        """
+        :return: True if value of relation field is serialized by default
+            method, so it can be fetched in batch
+        """
+        return self.is_default('get_field_value') and getattr(
+            self.get_value_method(field), '__func__', None
+        ) in (ModelSerializer.get_m2m_value, ModelSerializer.get_o2m_value)
+
+    def prefetch_relations(self, instances, field_names=None):
+        """
+        Fetch values of many to many and one to many fields for instances of
+        one model: one query to through table per many to many field, one
+        query per one to many field and one query per related model.
+        Values are used by the next serialization of instances.
+
+        :param field_names: names of fetched fields, all fields by default
+        """
+        if not instances:
+            return
+        fields = [
+            field
+            for field in get_tracking_options(instances[0].__class__).fields
+            if (field.many_to_many or field.one_to_many)
+            and self.has_default_value(field)
+            and (field_names is None or field.name in field_names)
+        ]
+        if not fields:
+            return
+        by_db = defaultdict(list)
+        for instance in instances:
+            instance.__dict__[RELATIONS_ATTR_NAME] = {
+                field.name: [] for field in fields
+            }
+            by_db[instance._state.db].append(instance)
+        for using, db_instances in by_db.items():
+            # (related model, attname) -> [(instance, field name, value)]
+            wanted = defaultdict(list)
+            for field in fields:
+                if field.many_to_many:
+                    self.prefetch_m2m(db_instances, field, wanted, using)
+                else:
+                    self.prefetch_o2m(db_instances, field, using)
+            for (model, attname), items in wanted.items():
+                self.prefetch_related_objects(model, attname, items, using)
+
+    def prefetch_m2m(self, instances, field, wanted, using=None):
+        through = field.remote_field.through
+        source = through._meta.get_field(field.m2m_field_name())
+        target = through._meta.get_field(field.m2m_reverse_field_name())
+        by_value = {
+            getattr(x, source.target_field.attname): x for x in instances
+        }
+        key = (field.related_model, target.target_field.attname)
+        for chunk in chunked(by_value, settings.BATCH_SIZE):
+            rows = (
+                through._base_manager.using(using)
+                .filter(**{source.attname + '__in': chunk})
+                .values_list(source.attname, target.attname)
+            )
+            wanted[key].extend((by_value[x], field.name, y) for x, y in rows)
+
+    def prefetch_o2m(self, instances, field, using=None):
+        remote = field.field
+        by_value = {
+            getattr(x, remote.target_field.attname): x for x in instances
+        }
+        for chunk in chunked(by_value, settings.BATCH_SIZE):
+            for obj in field.related_model._default_manager.using(
+                using
+            ).filter(**{remote.attname + '__in': chunk}):
+                instance = by_value[getattr(obj, remote.attname)]
+                # Representation of related object may use instance
+                remote.set_cached_value(obj, instance)
+                instance.__dict__[RELATIONS_ATTR_NAME][field.name].append(
+                    self.get_related_value(obj)
+                )
+
+    def prefetch_related_objects(self, model, attname, items, using=None):
+        # Positions keep default ordering of related model
+        positions = {}
+        for chunk in chunked({x[2] for x in items}, settings.BATCH_SIZE):
+            for obj in model._default_manager.using(using).filter(
+                **{attname + '__in': chunk}
+            ):
+                positions[getattr(obj, attname)] = (
+                    len(positions),
+                    self.get_related_value(obj),
+                )
+        items = sorted(
+            (x for x in items if x[2] in positions),
+            key=lambda x: positions[x[2]][0],
+        )
+        for instance, name, value in items:
+            instance.__dict__[RELATIONS_ATTR_NAME][name].append(
+                dict(positions[value][1])
+            )
+
+    def get_related_value(self, obj):
+        return {
+            'db': self.get_value_for_type(obj.pk),
+            'repr': get_obj_repr(obj),
+        }
 
     def get_m2m_value(self, instance, field):
+        relations = instance.__dict__.get(RELATIONS_ATTR_NAME)
+        if relations and field.name in relations:
+            return relations[field.name]
         return [
-            {'db': self.get_value_for_type(x.pk), 'repr': get_obj_repr(x)}
+            self.get_related_value(x)
             for x in getattr(instance, field.name).iterator()
         ]
 
     def get_o2m_value(self, instance, field):
+        relations = instance.__dict__.get(RELATIONS_ATTR_NAME)
+        if relations and field.name in relations:
+            return relations[field.name]
         return [
-            {'db': self.get_value_for_type(x.pk), 'repr': get_obj_repr(x)}
+            self.get_related_value(x)
             for x in getattr(instance, field.name).iterator()
         ]
 
     def get_fk_value(self, instance, field):
-        return {
-            'db': self.get_value_for_type(field.value_from_object(instance)),
-            'repr': self.get_value_for_type(getattr(instance, field.name))
-            or '',
-        }
+        value = field.value_from_object(instance)
+        if settings.FK_REPR == 'db':
+            return self.get_value_for_type(value)
+        if (
+            settings.FK_REPR == 'batch'
+            and value is not None
+            and not field.is_cached(instance)
+        ):
+            related_repr = DeferredRepr(self, field, value, instance._state.db)
+        else:
+            related_repr = (
+                self.get_value_for_type(getattr(instance, field.name)) or ''
+            )
+        return {'db': self.get_value_for_type(value), 'repr': related_repr}
 
     def get_choice_value(self, instance, field):
         return {
@@ -366,7 +1141,7 @@ class ModelSerializer(object):
 
     def get_file_value(self, instance, field):
         value = self.get_value_for_type(field.value_from_object(instance))
-        if settings.FILE_NAME_ONLY or instance.simple_log_file_name_only:
+        if get_tracking_options(instance.__class__).file_name_only:
             value = os.path.basename(value)
         return value
 
@@ -375,7 +1150,9 @@ class ModelSerializer(object):
 
     @staticmethod
     def get_value_for_type(value):
-        if value is None or isinstance(value, (int, bool, dict, list)):
+        if value is None or value.__class__ in ModelSerializer.plain_types:
+            return value
+        if isinstance(value, (int, bool, dict, list)):
             return value
         if isinstance(value, datetime.datetime) and settings.DATETIME_FORMAT:
             return value.strftime(settings.DATETIME_FORMAT)
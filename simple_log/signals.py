@@ -1,15 +1,19 @@
-import inspect
 from collections import defaultdict
 
-from request_vars.utils import del_variable, get_variable
+from request_vars.utils import del_variable, get_variable, set_variable
+
+from django.db import DEFAULT_DB_ALIAS, connections
 
 from simple_log.conf import settings
+from simple_log.deletion import DeletedBatch
 from simple_log.utils import (
+    find_related_logs,
     get_log_model,
-    get_obj_repr,
+    get_tracking_options,
+    get_writer,
     is_log_needed,
-    is_related_to,
-    serialize_instance,
+    resolve_deferred_reprs,
+    serialize_instances,
 )
 
 
@@ -18,86 +22,158 @@ __all__ = [
     'log_pre_save_handler',
     'log_post_save_handler',
     'log_pre_delete_handler',
+    'save_logs',
     'save_logs_on_commit',
     'save_related',
 ]
 
 
 def save_related(logs):
-    map_related = defaultdict(list)
-    for saved_log in [x for x in logs if x.pk and not x.disable_related]:
-        for related in [
-            log
-            for log in logs
-            if not log.disable_related and is_related_to(saved_log, log)
-        ]:
-            if not related.pk:
-                related.save()
-            map_related[related].append(saved_log)
-    for instance, related in map_related.items():
-        instance.related_logs.add(*related)
-
-
-def save_logs_on_commit():
-    all_logs = get_variable('simple_log_instances', {}).values()
-    for log in [x for x in all_logs if not x.pk]:
+    new_logs = defaultdict(list)
+    related_logs = defaultdict(list)
+    for log, related in find_related_logs(logs):
+        if not log.pk:
+            new_logs[log.__class__].append(log)
+        related_logs[log.__class__].append((log, related))
+    for log_model, model_logs in new_logs.items():
+        log_model.bulk_save(model_logs)
+    for log_model, model_related_logs in related_logs.items():
+        log_model.bulk_save_related(model_related_logs)
+
+
+def save_logs(groups):
+    """
+    Save logs of committed transactions.
+
+    :param groups: list of lists of logs, every list contains logs of one
+        transaction
+    """
+    new_logs = defaultdict(list)
+    for logs in groups:
+        for log in logs:
+            if not log.pk and (log.is_delete or log.old != log.new):
+                new_logs[log.__class__].append(log)
+    for log_model, logs in new_logs.items():
+        log_model.bulk_save(logs)
+
+    if settings.SAVE_RELATED:
+        for logs in groups:
+            if any(x.pk for x in logs if not x.disable_related):
+                save_related(logs)
+
+
+def save_logs_on_commit(all_logs):
+    """
+    Collect values of logs of committed transaction and write them.
+    """
+    pending = [x for x in all_logs if not x.pk]
+    full = [x for x in pending if x.m2m_delta is None]
+    new_values = serialize_instances(x.instance for x in full)
+    for log, new in zip(full, new_values):
         log.old = getattr(log.instance, '_old_value', None)
-        log.new = serialize_instance(log.instance)
-        if log.is_delete or log.old != log.new:
-            log.save()
-
-    if settings.SAVE_RELATED and any(
-        x.pk for x in all_logs if not x.disable_related
-    ):
-        save_related(all_logs)
-    del_variable('simple_log_instances')
+        log.new = new
+    # M2m changes made before object was saved are moved to its full log
+    full_logs = {x.instance: x for x in full if x.instance.pk is not None}
+    deltas, merged = [], set()
+    for log in pending:
+        if log.m2m_delta is None:
+            continue
+        full_log = full_logs.get(log.instance)
+        if full_log is None:
+            deltas.append(log)
+        else:
+            full_log.merge_m2m_delta(log.m2m_delta)
+            merged.add(id(log))
+    if deltas:
+        get_log_model().set_m2m_delta_values(deltas)
+    if merged:
+        all_logs = [x for x in all_logs if id(x) not in merged]
+    resolve_deferred_reprs(pending)
+    get_writer().write(all_logs)
+
+
+def clear_raw_instance():
+    del_variable('simple_log_raw_instance')
 
 
 def log_pre_save_handler(sender, instance, **kwargs):
-    if not is_log_needed(instance, kwargs.get('raw')):
+    if kwargs.get('raw'):
+        # Remember raw save for m2m changes, e.g. loaddata sets m2m values
+        # right after saving deserialized object. They are done, when other
+        # object is saved or transaction is committed.
+        if get_variable('simple_log_raw_instance') is None:
+            connection = connections[kwargs.get('using') or DEFAULT_DB_ALIAS]
+            if connection.in_atomic_block:
+                connection.on_commit(clear_raw_instance)
+        set_variable('simple_log_raw_instance', instance)
+    elif get_variable('simple_log_raw_instance') is not None:
+        clear_raw_instance()
+    # Flag of failed save, that post_save isn't sent for
+    instance.__dict__.pop('_simple_log_skipped', None)
+    if not is_log_needed(instance, kwargs.get('raw'), kwargs.get('using')):
+        return
+    options = get_tracking_options(instance.__class__)
+    if (
+        options.has_policy
+        and instance.pk is not None
+        and not instance._state.adding
+        and options.is_change_skipped(instance, kwargs.get('update_fields'))
+    ):
+        instance._simple_log_skipped = True
         return
     log_model = get_log_model()
     log_model.set_initial(instance, kwargs.get('using'))
 
 
 def log_post_save_handler(sender, instance, created, **kwargs):
-    if not is_log_needed(instance, kwargs.get('raw')):
+    skipped = instance.__dict__.pop('_simple_log_skipped', False)
+    if skipped or not is_log_needed(
+        instance, kwargs.get('raw'), kwargs.get('using')
+    ):
+        return
+    options = get_tracking_options(instance.__class__)
+    if not created and options.is_unchanged(
+        instance, kwargs.get('update_fields')
+    ):
+        # Initial state is fetched, if it isn't known before save
         return
     log_model = get_log_model()
-    log_model.log(
+    log = log_model.log(
         instance=instance,
         action_flag=log_model.ADD if created else log_model.CHANGE,
         commit=False,
         using=kwargs.get('using'),
     )
+    if log is not None and not created:
+        options.count_rate(instance.pk)
 
 
-def log_pre_delete_handler(sender, instance, **kwargs):
-    if not is_log_needed(instance, kwargs.get('raw')):
+def log_pre_delete_handler(sender, instance, origin=None, **kwargs):
+    if not is_log_needed(instance, kwargs.get('raw'), kwargs.get('using')):
         return
-    log_model = get_log_model()
-    log_model.set_initial(instance)
-    log_model.log(
-        instance=instance,
-        action_flag=log_model.DELETE,
-        commit=False,
-        object_repr=get_obj_repr(instance),
-        using=kwargs.get('using'),
-    )
+    # Cascade is logged in bulk before rows are deleted
+    DeletedBatch.add(instance, kwargs.get('using'), origin)
 
 
 def log_m2m_change_handler(sender, instance, action, **kwargs):
     # M2m change signal does not provide raw kwarg
-    raw = False
-    for fr in inspect.stack():
-        if inspect.getmodulename(fr[1]) in ('test', 'loaddata'):
-            raw = True
-            break
-    if not is_log_needed(instance, raw):
+    raw_instance = get_variable('simple_log_raw_instance')
+    raw = raw_instance is instance
+    if raw_instance is not None and not raw:
+        clear_raw_instance()
+    if not is_log_needed(instance, raw, kwargs.get('using')):
         return
     log_model = get_log_model()
+    if settings.M2M_DELTA and not kwargs.get('reverse'):
+        field = get_tracking_options(instance.__class__).m2m_fields.get(
+            sender
+        )
+        if field is not None and log_model.log_m2m_delta(
+            instance, field, action, kwargs.get('pk_set')
+        ):
+            return
     if action in ('pre_add', 'pre_remove', 'pre_clear'):
-        log_model.set_initial(instance)
+        log_model.set_initial(instance, kwargs.get('using'))
 
     if action in ('post_add', 'post_remove', 'post_clear'):
         log_model.log(
@@ -1,14 +1,24 @@
+import copy
 import logging
+import random
+import threading
+import time
+from collections import defaultdict
 from contextlib import ContextDecorator
 from functools import lru_cache
+from itertools import islice
 
 from request_vars.utils import del_variable, get_variable, set_variable
 
 from django.apps import apps as django_apps
 from django.core.exceptions import ImproperlyConfigured
+from django.db import router
+from django.db.models import Model
 from django.utils.encoding import force_str
+from django.utils.functional import cached_property
 from django.utils.module_loading import import_string
 
+from simple_log.buffer import LogBuffer
 from simple_log.conf import settings
 
 
@@ -16,20 +26,35 @@ __all__ = [
     'get_log_model',
     'get_current_user',
     'get_current_request',
+    'get_log_db',
+    'get_instance_db',
     'get_serializer',
+    'get_writer',
     'disable_logging',
     'get_model_list',
     'disable_related',
     'get_obj_repr',
     'is_related_to',
+    'find_related_logs',
     'get_fields',
     'ContextDecorator',
     'serialize_instance',
+    'serialize_instances',
+    'prefetch_initial',
+    'prefetch_deferred',
+    'prefetch_snapshots',
+    'get_tracking_options',
 ]
 
 
 logger = logging.getLogger('simple_log')
 
+SNAPSHOT_ATTR_NAME = '_simple_log_snapshot'
+RELATIONS_ATTR_NAME = '_simple_log_relations'
+M2M_REMOVED_ATTR_NAME = '_simple_log_m2m_removed'
+# Key of m2m delta log of instance in logs of transaction
+M2M_DELTA_KEY = 'm2m_delta'
+
 
 def check_log_model(model):
     from simple_log.models import SimpleLogAbstractBase
@@ -67,6 +92,40 @@ def get_serializer(model=None):
     return serializer
 
 
+def get_log_db(model):
+    """
+    :return: alias of database, that logs and their snapshots are saved to
+    """
+    return settings.DATABASE or router.db_for_write(model)
+
+
+def get_instance_db(instance, using=None):
+    """
+    :return: alias of database, that instance is written to, logs of instance
+        are saved on commit of its transaction
+    """
+    return (
+        using
+        or instance._state.db
+        or router.db_for_write(instance.__class__, instance=instance)
+    )
+
+
+@lru_cache(maxsize=None)
+def get_writer():
+    return import_string(settings.WRITER)(**settings.WRITER_OPTIONS)
+
+
+def clear_writer(setting=None, **kwargs):
+    names = (settings.prefix + 'WRITER', settings.prefix + 'WRITER_OPTIONS')
+    if setting is not None and setting not in names:
+        return
+    if get_writer.cache_info().currsize:
+        # Save logs of previous writer
+        get_writer().close()
+        get_writer.cache_clear()
+
+
 def get_current_request_default():
     return get_variable('request')
 
@@ -106,14 +165,146 @@ def get_fields(klass):
     ]
 
 
+class TrackingOptions(object):
+    """
+    Compiled options of tracking model, that are used on every log.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.fields = tuple(get_fields(model))
+        self.serializer = get_serializer(model)()
+        self.proxy_concrete = getattr(
+            model, 'simple_log_proxy_concrete', settings.PROXY_CONCRETE
+        )
+        self.file_name_only = settings.FILE_NAME_ONLY or getattr(
+            model, 'simple_log_file_name_only', False
+        )
+        self.parent_model_fields = tuple(
+            getattr(model, 'parent_model_fields', ())
+        )
+        self.m2m_fields = {
+            f.remote_field.through: f
+            for f in self.fields
+            if f.many_to_many and f.concrete
+        }
+        policy = settings.POLICIES.get(model._meta.label, {})
+        self.sample_rate = getattr(
+            model, 'simple_log_sample_rate', policy.get('sample_rate')
+        )
+        self.rate_limit = getattr(
+            model, 'simple_log_rate_limit', policy.get('rate_limit')
+        )
+        self.only_fields = tuple(
+            model._meta.get_field(x).attname
+            for x in getattr(
+                model, 'simple_log_only_fields', policy.get('only_fields', ())
+            )
+        )
+        self.has_policy = bool(
+            self.sample_rate is not None or self.rate_limit or self.only_fields
+        )
+        # Logs of objects in current window of rate limit
+        self.rate_window = None
+        self.rate_counts = {}
+        self.rate_lock = threading.Lock()
+
+    def is_unchanged(self, instance, update_fields=None):
+        """
+        :return: ``True``, if fields of ``only_fields`` are known to be not
+            changed, initial state isn't fetched for it
+        """
+        if not self.only_fields:
+            return False
+        if update_fields is not None:
+            names = {
+                self.model._meta.get_field(x).attname for x in update_fields
+            }
+            return not names.intersection(self.only_fields)
+        old_instance = getattr(instance, settings.OLD_INSTANCE_ATTR_NAME, None)
+        if old_instance is not None:
+            old_values = old_instance.__dict__
+        elif SNAPSHOT_ATTR_NAME in instance.__dict__:
+            _, field_names, values = instance.__dict__[SNAPSHOT_ATTR_NAME]
+            old_values = dict(zip(field_names, values))
+        else:
+            return False
+        return all(
+            x in old_values
+            and x in instance.__dict__
+            and old_values[x] == instance.__dict__[x]
+            for x in self.only_fields
+        )
+
+    def is_change_skipped(self, instance, update_fields=None):
+        """
+        Apply policies of model to change of instance. They are checked
+        before initial state is fetched and serialized.
+        """
+        if self.is_unchanged(instance, update_fields):
+            return True
+        if self.sample_rate is not None and random.random() >= (
+            self.sample_rate
+        ):
+            return True
+        return bool(self.rate_limit) and self.is_rate_limited(instance.pk)
+
+    def is_rate_limited(self, pk):
+        """
+        :return: ``True``, if object is logged ``count`` times in current
+            window of rate limit
+        """
+        count, seconds = self.rate_limit
+        with self.rate_lock:
+            return self.get_rate_counts(seconds).get(pk, 0) >= count
+
+    def count_rate(self, pk):
+        """
+        Count created log of object in fixed window of rate limit.
+        """
+        if not self.rate_limit:
+            return
+        with self.rate_lock:
+            counts = self.get_rate_counts(self.rate_limit[1])
+            counts[pk] = counts.get(pk, 0) + 1
+
+    def get_rate_counts(self, seconds):
+        window = int(time.monotonic() // seconds)
+        if window != self.rate_window:
+            self.rate_window = window
+            self.rate_counts = {}
+        return self.rate_counts
+
+    @cached_property
+    def content_type(self):
+        from django.contrib.contenttypes.models import ContentType
+
+        return ContentType.objects.get_for_model(
+            self.model, for_concrete_model=self.proxy_concrete
+        )
+
+
+@lru_cache(maxsize=None)
+def get_tracking_options(model):
+    return TrackingOptions(model)
+
+
+def clear_tracking_options(setting=None, **kwargs):
+    if setting is None or setting.startswith(settings.prefix):
+        get_tracking_options.cache_clear()
+
+
 @lru_cache(maxsize=None)
 def get_model_list():
     from simple_log.models import SimpleLogAbstractBase
 
+    # Snapshots and spool segments are internal models of logs
     model_list = [
         m
         for m in django_apps.get_models()
-        if not issubclass(m, SimpleLogAbstractBase) and m._meta.managed
+        if not issubclass(m, SimpleLogAbstractBase)
+        and m._meta.app_label != 'simple_log'
+        and m._meta.managed
     ]
     if settings.MODEL_LIST:
         model_list = [
@@ -161,6 +352,77 @@ def is_related_to(log, to_log):
             return True
 
 
+@lru_cache(maxsize=None)
+def get_relation_fields(klass):
+    return [
+        (f.attname, f.related_model, f.many_to_many)
+        for f in klass._meta.get_fields()
+        if f.related_model and f.concrete
+    ]
+
+
+@lru_cache(maxsize=None)
+def get_model_classes(klass):
+    return [x for x in klass.__mro__ if issubclass(x, Model)]
+
+
+def find_related_logs(logs, saved=None):
+    """
+    Same as checking ``is_related_to`` for every pair of logs, but walks
+    relation fields of every instance once using index of logs.
+
+    :param saved: logs, that are saved or will be saved, logs with primary
+        key by default
+    :return: list of tuples (log, list of saved logs related to it)
+    """
+    logs = [x for x in logs if not x.disable_related]
+    if saved is None:
+        saved = [x for x in logs if x.pk]
+    else:
+        saved = [x for x in saved if not x.disable_related]
+    positions = {id(x): i for i, x in enumerate(logs)}
+    index = defaultdict(list)
+    for i, log in enumerate(logs):
+        pk = log.instance.pk
+        if not pk:
+            # If deleted
+            old_instance = getattr(
+                log.instance, settings.OLD_INSTANCE_ATTR_NAME, None
+            )
+            pk = getattr(old_instance, 'pk', None)
+        for klass in get_model_classes(log.instance.__class__):
+            index[(klass, pk)].append(i)
+
+    related_map = {}
+    for log in saved:
+        instance = log.instance
+        old_instance = getattr(instance, settings.OLD_INSTANCE_ATTR_NAME, None)
+        found = {
+            positions[id(x)]
+            for x in log._get_related_objects()
+            if id(x) in positions
+        }
+        for attname, related_model, many_to_many in get_relation_fields(
+            instance.__class__
+        ):
+            if many_to_many:
+                # Value of m2m field is a manager, it's never equal to pk
+                if not instance.pk or old_instance is not None:
+                    continue
+                values = {None}
+            else:
+                values = {
+                    getattr(instance, attname, None),
+                    getattr(old_instance, attname, None),
+                }
+            for value in values:
+                found.update(index.get((related_model, value), ()))
+        for i in sorted(found):
+            if logs[i].instance != instance:
+                related_map.setdefault(i, []).append(log)
+    return [(logs[i], related) for i, related in related_map.items()]
+
+
 class disable_logging(ContextDecorator):
     def __enter__(self):
         set_variable('disable_logging', True)
@@ -186,8 +448,9 @@ def get_obj_repr(obj):
 
 
 def serialize_instance(instance):
-    serializer_class = get_serializer(instance.__class__)
-    serializer = serializer_class()
+    if instance is None:
+        return None
+    serializer = get_tracking_options(instance.__class__).serializer
     try:
         return serializer(instance)
     except Exception:
@@ -198,12 +461,199 @@ def serialize_instance(instance):
         )
 
 
-def is_log_needed(instance, raw):
+def serialize_instances(instances):
+    """
+    Serialize many instances, values of many to many and one to many fields
+    are fetched for all instances of model at once.
+
+    :return: list of serialized values in the same order
+    """
+    instances = list(instances)
+    by_class = defaultdict(list)
+    for instance in instances:
+        if instance is not None and instance.pk is not None:
+            by_class[instance.__class__].append(instance)
+    try:
+        for klass, objects in by_class.items():
+            serializer = get_tracking_options(klass).serializer
+            prefetch = getattr(serializer, 'prefetch_relations', None)
+            if prefetch is None:
+                continue
+            try:
+                prefetch(objects)
+            except Exception:
+                logger.exception("Can't prefetch relations of %s", klass)
+        return [serialize_instance(x) for x in instances]
+    finally:
+        for objects in by_class.values():
+            for instance in objects:
+                instance.__dict__.pop(RELATIONS_ATTR_NAME, None)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+class DeferredRepr(object):
+    """
+    Representation of related object, that will be fetched for all logs of
+    transaction at once.
+    """
+
+    def __init__(self, serializer, field, value, using=None):
+        self.serializer = serializer
+        self.model = field.related_model
+        self.attname = field.target_field.attname
+        self.value = value
+        # Database of instance, related object is read from it
+        self.using = using
+
+
+def resolve_deferred_reprs(logs):
+    deferred = defaultdict(list)
+    for log in logs:
+        for values in (log.old, log.new):
+            for item in (values or {}).values():
+                value = item.get('value') if isinstance(item, dict) else None
+                if isinstance(value, dict) and isinstance(
+                    value.get('repr'), DeferredRepr
+                ):
+                    deferred_repr = value['repr']
+                    deferred[
+                        (
+                            deferred_repr.model,
+                            deferred_repr.attname,
+                            deferred_repr.using,
+                        )
+                    ].append(value)
+    for (model, attname, using), values in deferred.items():
+        objects = {}
+        for chunk in chunked(
+            {x['repr'].value for x in values}, settings.BATCH_SIZE
+        ):
+            objects.update(
+                (getattr(x, attname), x)
+                for x in model._base_manager.using(using).filter(
+                    **{attname + '__in': chunk}
+                )
+            )
+        for value in values:
+            obj = objects.get(value['repr'].value)
+            value['repr'] = (
+                value['repr'].serializer.get_value_for_type(obj) or ''
+                if obj is not None
+                else ''
+            )
+
+
+def prefetch_initial(instances, using=None, batch_size=None):
+    """
+    Load initial state of many instances with chunked ``pk__in`` queries,
+    so ``set_initial`` will not fetch every instance separately.
+
+    :return: list of instances
+    """
+    instances = list(instances)
+    batch_size = batch_size or settings.BATCH_SIZE
+    attr_name = settings.OLD_INSTANCE_ATTR_NAME
+    by_model = {}
+    for instance in instances:
+        if instance.pk and not hasattr(instance, attr_name):
+            by_model.setdefault(instance.__class__, []).append(instance)
+    for model, model_instances in by_model.items():
+        for chunk in chunked(model_instances, batch_size):
+            old_instances = model._base_manager.using(using).in_bulk(
+                {x.pk for x in chunk}
+            )
+            for instance in chunk:
+                if instance.pk in old_instances:
+                    setattr(instance, attr_name, old_instances[instance.pk])
+    return instances
+
+
+def prefetch_deferred(instances, using=None, batch_size=None):
+    """
+    Load deferred fields of many instances with chunked ``pk__in`` queries,
+    so they will not be fetched for every instance separately on access.
+
+    :return: list of instances
+    """
+    instances = list(instances)
+    batch_size = batch_size or settings.BATCH_SIZE
+    by_model = {}
+    for instance in instances:
+        if instance.pk is not None and instance.get_deferred_fields():
+            by_model.setdefault(instance.__class__, []).append(instance)
+    for model, model_instances in by_model.items():
+        for chunk in chunked(model_instances, batch_size):
+            loaded = model._base_manager.using(using).in_bulk(
+                {x.pk for x in chunk}
+            )
+            for instance in chunk:
+                if instance.pk not in loaded:
+                    continue
+                for attname in instance.get_deferred_fields():
+                    setattr(
+                        instance,
+                        attname,
+                        getattr(loaded[instance.pk], attname),
+                    )
+    return instances
+
+
+def snapshot_on_load(from_db):
+    """
+    Wrap ``Model.from_db`` to keep loaded values on instance, they are used
+    as initial state instead of fetching it again before save.
+    """
+
+    def wrapper(cls, db, field_names, values):
+        instance = from_db.__func__(cls, db, field_names, values)
+        if settings.SNAPSHOT_ON_LOAD:
+            # Only references to already loaded values are stored, old
+            # instance is created if instance is saved. Mutable values (e.g.
+            # of JSONField) are copied, they can be changed in place.
+            if any(isinstance(x, (dict, list)) for x in values):
+                values = [
+                    copy.deepcopy(x) if isinstance(x, (dict, list)) else x
+                    for x in values
+                ]
+            instance.__dict__[SNAPSHOT_ATTR_NAME] = (db, field_names, values)
+        return instance
+
+    wrapper.simple_log_snapshot = True
+    return classmethod(wrapper)
+
+
+def prefetch_snapshots(logs):
+    """
+    Load old and new values of logs, that are saved with ``DEDUPLICATE``,
+    with one query instead of one query per value on access.
+
+    :return: list of logs
+    """
+    from simple_log.models import SnapshotBlob
+
+    logs = list(logs)
+    by_db = defaultdict(list)
+    for log in logs:
+        by_db[log._state.db].append(log)
+    for db, db_logs in by_db.items():
+        SnapshotBlob.prefetch(db_logs, db)
+    return logs
+
+
+def is_log_needed(instance, raw, using=None):
     return settings.ENABLED and not (
         get_variable('disable_logging')
         or (
             instance.pk
-            and instance in get_variable('simple_log_instances', {})
+            and LogBuffer.get_log(instance, get_instance_db(instance, using))
+            is not None
         )
         or (raw and settings.EXCLUDE_RAW)
     )
@@ -0,0 +1,337 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, connections, transaction
+
+from simple_log.conf import settings
+from simple_log.signals import save_logs
+from simple_log.utils import find_related_logs, get_log_db
+
+
+__all__ = ['DatabaseWriter', 'ThreadWriter', 'SpoolWriter']
+
+
+logger = logging.getLogger('simple_log')
+
+
+class DatabaseWriter(object):
+    """
+    Save logs of transaction right after commit.
+    """
+
+    def write(self, logs):
+        save_logs([logs])
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class ThreadWriter(DatabaseWriter):
+    """
+    Save logs in background thread. Logs of committed transactions are put
+    to bounded queue and saved together, when ``batch_size`` logs are
+    collected or ``flush_interval`` seconds are passed. If queue is full for
+    ``put_timeout`` seconds, logs are saved in calling thread. Queue is
+    flushed at exit.
+    """
+
+    flush_marker = object()
+    stop_marker = object()
+
+    def __init__(
+        self,
+        max_size=1000,
+        batch_size=None,
+        flush_interval=1.0,
+        put_timeout=1.0,
+    ):
+        self.queue = queue.Queue(max_size)
+        self.batch_size = batch_size or settings.BATCH_SIZE
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.lock = threading.Lock()
+        self.thread = None
+        atexit.register(self.close)
+
+    def write(self, logs):
+        self.start()
+        try:
+            self.queue.put(logs, timeout=self.put_timeout)
+        except queue.Full:
+            logger.warning('Queue of logs is full, logs are saved in place.')
+            super(ThreadWriter, self).write(logs)
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.run, name='simple_log_writer', daemon=True
+                )
+                self.thread.start()
+
+    def run(self):
+        try:
+            stop = False
+            while not stop:
+                batch = self.get_batch()
+                stop = self.stop_marker in batch
+                self.save([x for x in batch if isinstance(x, list)])
+                for _ in batch:
+                    self.queue.task_done()
+        finally:
+            connections.close_all()
+
+    def get_batch(self):
+        """
+        :return: list of items from queue, the first one is waited forever,
+            next ones until batch is full, flush interval is passed or marker
+            is received
+        """
+        batch = [self.queue.get()]
+        count = 0
+        deadline = time.monotonic() + self.flush_interval
+        while isinstance(batch[-1], list):
+            count += len(batch[-1])
+            timeout = deadline - time.monotonic()
+            if count >= self.batch_size or timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def save(self, groups):
+        if not groups:
+            return
+        try:
+            close_old_connections()
+            save_logs(groups)
+        except Exception:
+            logger.exception("Can't save logs.")
+
+    def flush(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(self.flush_marker)
+            self.queue.join()
+
+    def close(self):
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+        if thread is not None and thread.is_alive():
+            self.queue.put(self.stop_marker)
+            thread.join()
+
+
+class SpoolWriter(DatabaseWriter):
+    """
+    Append logs to local JSONL spool file, that is shared by processes of
+    host. File is locked while written and rotated to segment, when it's
+    larger than ``max_bytes``. Segments are saved to database by
+    ``ingest_logs`` command.
+    """
+
+    current_name = 'current.jsonl'
+    segment_prefix = 'segment-'
+
+    def __init__(self, path, max_bytes=16 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, logs):
+        records = self.get_records(logs)
+        if not records:
+            return
+        data = ''.join(
+            json.dumps(x, cls=DjangoJSONEncoder, separators=(',', ':')) + '\n'
+            for x in records
+        ).encode()
+        with self.lock() as f:
+            f.write(data)
+            f.flush()
+            if os.fstat(f.fileno()).st_size >= self.max_bytes:
+                self.rename_current()
+
+    def get_records(self, logs):
+        """
+        :return: list of dicts with fields of logs to save, related logs are
+            referenced by keys of records or by primary keys
+        """
+        saved = [
+            x for x in logs if not x.pk and (x.is_delete or x.old != x.new)
+        ]
+        related = {}
+        if settings.SAVE_RELATED:
+            for log, related_logs in find_related_logs(
+                logs, saved + [x for x in logs if x.pk]
+            ):
+                related[id(log)] = related_logs
+                if not log.pk and all(x is not log for x in saved):
+                    saved.append(log)
+        keys = {id(x): uuid.uuid4().hex for x in saved}
+        return [
+            {
+                'key': keys[id(log)],
+                'model': log._meta.label,
+                'fields': {
+                    field.attname: field.value_from_object(log)
+                    for field in log._meta.concrete_fields
+                    if not field.primary_key
+                },
+                'related': [
+                    keys[id(x)]
+                    for x in related.get(id(log), [])
+                    if id(x) in keys
+                ],
+                'related_pks': [
+                    x.pk for x in related.get(id(log), []) if x.pk
+                ],
+            }
+            for log in saved
+        ]
+
+    @contextmanager
+    def lock(self):
+        """
+        Open current spool file, locked exclusively.
+        """
+        import fcntl
+
+        current = os.path.join(self.path, self.current_name)
+        while True:
+            f = open(current, 'ab')
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.stat(current).st_ino == os.fstat(f.fileno()).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            # File is rotated by another process
+            f.close()
+        try:
+            yield f
+        finally:
+            f.close()
+
+    def rename_current(self):
+        os.rename(
+            os.path.join(self.path, self.current_name),
+            os.path.join(
+                self.path,
+                '{}{:020d}-{}.jsonl'.format(
+                    self.segment_prefix, time.time_ns(), uuid.uuid4().hex
+                ),
+            ),
+        )
+
+    def rotate(self):
+        """
+        Rename current spool file to segment, if it's not empty.
+        """
+        with self.lock() as f:
+            if os.fstat(f.fileno()).st_size:
+                self.rename_current()
+
+    def get_segments(self):
+        """
+        :return: sorted list of names of rotated segments
+        """
+        return sorted(
+            x
+            for x in os.listdir(self.path)
+            if x.startswith(self.segment_prefix) and x.endswith('.jsonl')
+        )
+
+    def ingest(self, name):
+        """
+        Save logs of segment in one transaction and delete it after commit.
+        Segment is locked exclusively, so concurrent commands ingest it once.
+
+        :return: number of saved logs
+        """
+        import fcntl
+
+        from simple_log.models import SpoolSegment
+
+        path = os.path.join(self.path, name)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            # Segment is ingested by another process
+            return 0
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            if not os.path.exists(path):
+                # Segment is ingested, while lock was awaited
+                return 0
+            records = self.read_records(f, name)
+
+            logs = {}
+            by_model = defaultdict(list)
+            for record in records:
+                log_model = apps.get_model(record['model'])
+                log = log_model(
+                    **{
+                        log_model._meta.get_field(k).attname: (
+                            log_model._meta.get_field(k).to_python(v)
+                        )
+                        for k, v in record['fields'].items()
+                    }
+                )
+                logs[record['key']] = log
+                by_model[log_model].append(log)
+
+            count = 0
+            db = get_log_db(next(iter(by_model), SpoolSegment))
+            with transaction.atomic(using=db):
+                segment, created = SpoolSegment._default_manager.using(
+                    db
+                ).get_or_create(name=name)
+                if created:
+                    for log_model, model_logs in by_model.items():
+                        log_model.bulk_save(model_logs)
+                        count += len(model_logs)
+                    self.save_related(records, logs)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            SpoolSegment._default_manager.using(db).filter(name=name).delete()
+        return count
+
+    @staticmethod
+    def read_records(f, name):
+        records = []
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                logger.warning('Skip broken record in %s.', name)
+        return records
+
+    @staticmethod
+    def save_related(records, logs):
+        related_logs = defaultdict(list)
+        for record in records:
+            log = logs[record['key']]
+            related = [logs[x] for x in record['related'] if x in logs]
+            related += [log.__class__(pk=x) for x in record['related_pks']]
+            if related:
+                related_logs[log.__class__].append((log, related))
+        for log_model, model_related_logs in related_logs.items():
+            log_model.bulk_save_related(model_related_logs)
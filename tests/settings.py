@@ -65,6 +65,10 @@ DATABASES = {
         'PORT': os.environ.get('POSTGRES_PORT', 5432),
     }
 }
+DATABASES['logs'] = dict(
+    DATABASES['default'],
+    NAME=os.environ.get('POSTGRES_LOGS_DB', 'simple_log_logs'),
+)
 
 LANGUAGE_CODE = 'en'
 TIME_ZONE = 'UTC'
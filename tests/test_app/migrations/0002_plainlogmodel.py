@@ -0,0 +1,110 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:03
+
+import django.utils.timezone
+from django.db import migrations, models
+
+import simple_log.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('test_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlainLogModel',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                (
+                    'action_time',
+                    models.DateTimeField(
+                        default=django.utils.timezone.now,
+                        editable=False,
+                        verbose_name='action time',
+                    ),
+                ),
+                (
+                    'user_repr',
+                    models.TextField(blank=True, verbose_name='user repr'),
+                ),
+                (
+                    'user_ip',
+                    models.GenericIPAddressField(
+                        null=True, verbose_name='IP address'
+                    ),
+                ),
+                (
+                    'object_id',
+                    models.TextField(
+                        blank=True, null=True, verbose_name='object id'
+                    ),
+                ),
+                (
+                    'object_repr',
+                    models.TextField(blank=True, verbose_name='object repr'),
+                ),
+                (
+                    'old',
+                    simple_log.fields.SimpleJSONField(
+                        null=True, verbose_name='old values'
+                    ),
+                ),
+                (
+                    'new',
+                    simple_log.fields.SimpleJSONField(
+                        null=True, verbose_name='new values'
+                    ),
+                ),
+                (
+                    'change_message',
+                    models.TextField(
+                        blank=True, verbose_name='change message'
+                    ),
+                ),
+                (
+                    'action_flag',
+                    models.PositiveSmallIntegerField(
+                        choices=[(1, 'added'), (2, 'changed'), (3, 'deleted')],
+                        verbose_name='action flag',
+                    ),
+                ),
+                (
+                    'content_type_label',
+                    models.CharField(
+                        blank=True,
+                        db_index=True,
+                        max_length=255,
+                        verbose_name='content type',
+                    ),
+                ),
+                (
+                    'user_id',
+                    models.TextField(
+                        blank=True, null=True, verbose_name='user id'
+                    ),
+                ),
+                (
+                    'related_logs',
+                    simple_log.fields.SimpleManyToManyField(
+                        blank=True, to='self', verbose_name='related log'
+                    ),
+                ),
+            ],
+            options={
+                'verbose_name': 'log entry',
+                'verbose_name_plural': 'logs entries',
+                'ordering': ('-action_time',),
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('test_app', '0002_plainlogmodel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NestedModel',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                (
+                    'char_field',
+                    models.CharField(
+                        max_length=100, verbose_name='Char field'
+                    ),
+                ),
+                (
+                    'related_model',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='nested_entries',
+                        to='test_app.relatedmodel',
+                    ),
+                ),
+            ],
+            options={
+                'verbose_name': 'nested entry',
+                'verbose_name_plural': 'nested entries',
+                'ordering': ['pk'],
+            },
+        ),
+    ]
@@ -1,6 +1,10 @@
 from django.db import models
 
-from simple_log.models import ModelSerializer, SimpleLogAbstract
+from simple_log.models import (
+    ModelSerializer,
+    SimpleLogAbstract,
+    SimpleLogPlainAbstract,
+)
 
 
 class TestModel(models.Model):
@@ -101,10 +105,29 @@ class RelatedModel(models.Model):
         return 'Related entry of the "%s"' % self.third_model
 
 
+class NestedModel(models.Model):
+    related_model = models.ForeignKey(
+        RelatedModel, related_name='nested_entries', on_delete=models.CASCADE
+    )
+    char_field = models.CharField(verbose_name='Char field', max_length=100)
+
+    class Meta:
+        verbose_name = 'nested entry'
+        verbose_name_plural = 'nested entries'
+        ordering = ['pk']
+
+    def __str__(self):
+        return self.char_field
+
+
 class SwappableLogModel(SimpleLogAbstract):
     pass
 
 
+class PlainLogModel(SimpleLogPlainAbstract):
+    pass
+
+
 class BadLogModel(models.Model):
     pass
 
@@ -9,7 +9,12 @@ from django.urls import reverse
 from django.utils.encoding import force_str
 
 from simple_log.models import SimpleLog
-from simple_log.utils import disable_logging, get_fields, get_serializer
+from simple_log.utils import (
+    disable_logging,
+    get_fields,
+    get_serializer,
+    get_tracking_options,
+)
 
 from .test_app.models import (
     CustomSerializer,
@@ -336,7 +341,9 @@ class AdminTestCase(TransactionTestCase):
     )
     def test_concrete_model_fields_add(self, mocked):
         other_model = OtherModel.objects.create(char_field='other')
-        with isolate_lru_cache(get_fields):
+        with isolate_lru_cache(get_fields), isolate_lru_cache(
+            get_tracking_options
+        ):
             initial_count = SimpleLog.objects.count()
             self.add_object(
                 TestModel, {'char_field': 'test', 'fk_field': other_model}
@@ -357,7 +364,9 @@ class AdminTestCase(TransactionTestCase):
     )
     def test_concrete_model_exclude_fields_add(self, mocked):
         other_model = OtherModel.objects.create(char_field='other')
-        with isolate_lru_cache(get_fields):
+        with isolate_lru_cache(get_fields), isolate_lru_cache(
+            get_tracking_options
+        ):
             initial_count = SimpleLog.objects.count()
             self.add_object(
                 TestModel, {'char_field': 'test', 'fk_field': other_model}
@@ -485,7 +494,8 @@ class AdminTestCase(TransactionTestCase):
     def test_concrete_model_proxy_concrete(self, mocked):
         initial_count = SimpleLog.objects.count()
         params = {'char_field': 'test'}
-        self.add_object(TestModelProxy, params)
+        with isolate_lru_cache(get_tracking_options):
+            self.add_object(TestModelProxy, params)
         self.assertEqual(SimpleLog.objects.count(), initial_count + 1)
         sl = SimpleLog.objects.latest('pk')
         self.assertEqual(
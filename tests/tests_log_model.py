@@ -1,9 +1,13 @@
 from django.contrib.admin.utils import quote
+from django.contrib.auth.models import User
+from django.db import connection
 from django.db.transaction import atomic
-from django.test import TransactionTestCase
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from simple_log.models import SimpleLog
+from simple_log.utils import disable_logging
 
 from .test_app.models import OtherModel, TestModel
 
@@ -80,6 +84,207 @@ class LogModelTestCase(TransactionTestCase):
         self.assertListEqual(added, [{'db': other_model2.pk, 'repr': 'test2'}])
         self.assertListEqual(removed, [{'db': other_model.pk, 'repr': 'test'}])
 
+    @override_settings(SIMPLE_LOG_M2M_DELTA=True)
+    def test_log_m2m_delta(self):
+        others = [
+            OtherModel.objects.create(char_field='test{}'.format(i))
+            for i in range(5)
+        ]
+        obj = TestModel.objects.create(char_field='test')
+        obj.m2m_field.add(*others[:3])
+        sl = SimpleLog.objects.latest('pk')
+        self.assertEqual(sl.action_flag, SimpleLog.CHANGE)
+        self.assertDictEqual(
+            sl.old, {'m2m_field': {'label': 'M2m field', 'value': []}}
+        )
+        self.assertDictEqual(
+            sl.new,
+            {
+                'm2m_field': {
+                    'label': 'M2m field',
+                    'value': [
+                        {'db': x.pk, 'repr': x.char_field}
+                        for x in others[:3]
+                    ],
+                }
+            },
+        )
+
+        obj = TestModel.objects.get(pk=obj.pk)
+        initial_count = SimpleLog.objects.count()
+        with CaptureQueriesContext(connection) as ctx, atomic():
+            obj.m2m_field.add(others[3], others[4])
+            obj.m2m_field.remove(others[0], others[4])
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 1)
+        # Relation is not serialized before change, changed items are
+        # fetched on change and current items once on commit
+        self.assertEqual(
+            len(
+                [
+                    x
+                    for x in ctx.captured_queries
+                    if 'FROM "test_app_othermodel"' in x['sql']
+                ]
+            ),
+            3,
+        )
+        sl = SimpleLog.objects.latest('pk')
+        added, removed = sl.m2m_field_diff('m2m_field')
+        self.assertListEqual(added, [{'db': others[3].pk, 'repr': 'test3'}])
+        self.assertListEqual(removed, [{'db': others[0].pk, 'repr': 'test0'}])
+        self.assertListEqual(
+            sl.get_differences(),
+            [
+                {
+                    'label': 'M2m field',
+                    'old': [
+                        {'db': x.pk, 'repr': x.char_field}
+                        for x in (others[1], others[2], others[0])
+                    ],
+                    'new': [
+                        {'db': x.pk, 'repr': x.char_field}
+                        for x in others[1:4]
+                    ],
+                }
+            ],
+        )
+
+        # Net changes are empty
+        with atomic():
+            obj.m2m_field.add(others[0])
+            obj.m2m_field.remove(others[0])
+            obj.m2m_field.remove(others[4])
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 1)
+
+        obj.m2m_field.clear()
+        sl = SimpleLog.objects.latest('pk')
+        self.assertListEqual(sl.new['m2m_field']['value'], [])
+        self.assertListEqual(
+            sl.old['m2m_field']['value'],
+            [{'db': x.pk, 'repr': x.char_field} for x in others[1:4]],
+        )
+
+        # Full log of instance already contains changes of m2m field
+        initial_count = SimpleLog.objects.count()
+        with atomic():
+            obj.char_field = 'changed'
+            obj.save()
+            obj.m2m_field.add(others[0])
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 1)
+        sl = SimpleLog.objects.latest('pk')
+        self.assertEqual(sl.new['char_field']['value'], 'changed')
+        self.assertEqual(len(sl.new['m2m_field']['value']), 1)
+
+        # Changes of m2m field made before save are moved to full log
+        initial_count = SimpleLog.objects.count()
+        with atomic():
+            obj.m2m_field.add(others[1])
+            obj.m2m_field.remove(others[0])
+            obj.char_field = 'changed again'
+            obj.save()
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 1)
+        sl = SimpleLog.objects.latest('pk')
+        self.assertEqual(sl.new['char_field']['value'], 'changed again')
+        self.assertListEqual(
+            sl.old['m2m_field']['value'],
+            [{'db': others[0].pk, 'repr': 'test0'}],
+        )
+        self.assertListEqual(
+            sl.new['m2m_field']['value'],
+            [{'db': others[1].pk, 'repr': 'test1'}],
+        )
+
+    def test_m2m_delta_admin(self):
+        User.objects.create_superuser('user', 'test@example.com', 'pass')
+        self.client.login(username='user', password='pass')
+        with disable_logging():
+            others = [
+                OtherModel.objects.create(char_field='test{}'.format(i))
+                for i in range(3)
+            ]
+            obj = TestModel.objects.create(char_field='test')
+            obj.m2m_field.add(*others[:2])
+        differences = []
+        for delta in (False, True):
+            with override_settings(SIMPLE_LOG_M2M_DELTA=delta):
+                with atomic():
+                    obj.m2m_field.add(others[2])
+                    obj.m2m_field.remove(others[1])
+            sl = SimpleLog.objects.latest('pk')
+            response = self.client.get(
+                reverse('admin:simple_log_simplelog_change', args=(sl.pk,))
+            )
+            differences.append(response.context['original'].get_differences())
+            with disable_logging():
+                obj.m2m_field.set(others[:2])
+        # Delta log shows whole lists of items like full log
+        self.assertListEqual(differences[1], differences[0])
+        self.assertContains(response, 'test0', count=2)
+
+    def test_diff_only(self):
+        other_model = OtherModel.objects.create(char_field='test')
+        obj = TestModel.objects.create(char_field='test')
+        with override_settings(
+            SIMPLE_LOG_DIFF_ONLY=True, SIMPLE_LOG_CHECKPOINT_INTERVAL=3
+        ):
+            obj = TestModel.objects.get(pk=obj.pk)
+            with atomic():
+                obj.char_field = 'changed'
+                obj.save()
+                obj.m2m_field.add(other_model)
+            sl = SimpleLog.objects.latest('pk')
+            self.assertIsNone(sl.old)
+            self.assertDictEqual(
+                sl.new,
+                {
+                    '$diff': {
+                        'char_field': ['Char field', 'test', 'changed'],
+                        'm2m_field': [
+                            'M2m field',
+                            [],
+                            [{'db': other_model.pk, 'repr': 'test'}],
+                        ],
+                    }
+                },
+            )
+            self.assertDictEqual(
+                sl.changed_fields,
+                {'char_field': 'Char field', 'm2m_field': 'M2m field'},
+            )
+            self.assertListEqual(
+                sl.get_differences(),
+                [
+                    {'label': 'Char field', 'old': 'test', 'new': 'changed'},
+                    {
+                        'label': 'M2m field',
+                        'old': [],
+                        'new': [{'db': other_model.pk, 'repr': 'test'}],
+                    },
+                ],
+            )
+            self.assertTupleEqual(
+                sl.m2m_field_diff('m2m_field'),
+                ([{'db': other_model.pk, 'repr': 'test'}], []),
+            )
+
+            # Third log of object is checkpoint with full values
+            obj = TestModel.objects.get(pk=obj.pk)
+            obj.char_field = 'checkpoint'
+            obj.save()
+            sl = SimpleLog.objects.latest('pk')
+            self.assertEqual(sl.old['char_field']['value'], 'changed')
+            self.assertEqual(sl.new['char_field']['value'], 'checkpoint')
+            self.assertIn('fk_field', sl.new)
+            self.assertDictEqual(
+                sl.changed_fields, {'char_field': 'Char field'}
+            )
+
+            obj = TestModel.objects.get(pk=obj.pk)
+            obj.delete()
+            sl = SimpleLog.objects.latest('pk')
+            self.assertEqual(sl.action_flag, SimpleLog.DELETE)
+            self.assertEqual(sl.old['char_field']['value'], 'checkpoint')
+
     def test_log_get_differences(self):
         TestModel.objects.create(char_field='test')
         obj = TestModel.objects.latest('pk')
@@ -131,3 +336,26 @@ class LogModelTestCase(TransactionTestCase):
         obj.delete()
         sl = SimpleLog.objects.latest('pk')
         self.assertEqual(str(sl), '{}: {}'.format(sl.object_repr, 'deleted'))
+
+    @override_settings(SIMPLE_LOG_BATCH_SIZE=2)
+    def test_bulk_save_on_commit(self):
+        initial_count = SimpleLog.objects.count()
+        with CaptureQueriesContext(connection) as ctx:
+            with atomic():
+                for i in range(5):
+                    TestModel.objects.create(char_field='test{}'.format(i))
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 5)
+        table = SimpleLog._meta.db_table
+        inserts = [
+            x
+            for x in ctx.captured_queries
+            if x['sql'].startswith('INSERT INTO "{}"'.format(table))
+        ]
+        self.assertEqual(len(inserts), 3)
+        self.assertListEqual(
+            [
+                x.new['char_field']['value']
+                for x in SimpleLog.objects.order_by('pk')
+            ],
+            ['test{}'.format(i) for i in range(5)],
+        )
@@ -1,30 +1,70 @@
+import fcntl
+import json
+import os
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock
+
 from django.apps import apps
+from django.contrib import admin
+from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
+from django.core import serializers
 from django.core.exceptions import ImproperlyConfigured
 from django.core.management import call_command
-from django.test import TransactionTestCase, override_settings
-from django.test.utils import isolate_lru_cache
+from django.db import connection, connections
+from django.db.models.signals import pre_save
+from django.db.transaction import atomic, set_rollback
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext, isolate_lru_cache
 from django.utils import timezone
 from django.utils.encoding import force_str
 
+from simple_log.admin import SimpleLogModelAdmin
+from simple_log.buffer import LogBuffer
 from simple_log.conf import settings
-from simple_log.models import SimpleLog, SimpleLogAbstract
+from simple_log.models import (
+    SimpleLog,
+    SimpleLogAbstract,
+    SnapshotBlob,
+    SnapshotSchema,
+    SpoolSegment,
+)
 from simple_log.utils import (
+    SNAPSHOT_ATTR_NAME,
+    disable_logging,
     get_fields,
     get_log_model,
     get_model_list,
     get_serializer,
+    get_tracking_options,
+    get_writer,
+    prefetch_snapshots,
+    serialize_instance,
 )
+from simple_log.writers import SpoolWriter, ThreadWriter
 
 from .test_app.models import (
     CustomSerializer,
     OtherModel,
+    PlainLogModel,
+    RelatedModel,
     SwappableLogModel,
     TestModel,
     TestModelProxy,
+    ThirdModel,
 )
 
 
+class BlockingWriter(ThreadWriter):
+    event = threading.Event()
+
+    def save(self, groups):
+        self.event.wait()
+        super(BlockingWriter, self).save(groups)
+
+
 class SettingsTestCase(TransactionTestCase):
     @override_settings(SIMPLE_LOG_MODEL_LIST=('test_app.OtherModel',))
     def test_model_list_add(self):
@@ -36,7 +76,9 @@ class SettingsTestCase(TransactionTestCase):
         model_list = [
             x
             for x in apps.get_models()
-            if not issubclass(x, SimpleLogAbstract) and x is not OtherModel
+            if not issubclass(x, SimpleLogAbstract)
+            and x._meta.app_label != 'simple_log'
+            and x is not OtherModel
         ]
         with isolate_lru_cache(get_model_list):
             self.assertListEqual(get_model_list(), model_list)
@@ -153,6 +195,7 @@ class SettingsTestCase(TransactionTestCase):
             x
             for x in apps.get_models()
             if not issubclass(x, SimpleLogAbstract)
+            and x._meta.app_label != 'simple_log'
         ]
         with isolate_lru_cache(get_model_list):
             self.assertListEqual(get_model_list(), all_models)
@@ -241,9 +284,718 @@ class SettingsTestCase(TransactionTestCase):
         call_command('loaddata', *fixtures, verbosity=0)
         self.assertEqual(SimpleLog.objects.count(), initial_count)
 
+        # M2m changes are raw only right after raw save
+        other_model = OtherModel.objects.create(char_field='other')
+        data = serializers.serialize('json', [TestModel(pk=100)])
+        with atomic():
+            objects = list(serializers.deserialize('json', data))
+            objects[0].m2m_data = {'m2m_field': [other_model.pk]}
+            objects[0].save()
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 1)
+        obj = objects[0].object
+        obj.m2m_field.remove(other_model)
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 2)
+        sl = SimpleLog.objects.latest('pk')
+        self.assertEqual(sl.object_id, str(obj.pk))
+        self.assertListEqual(sl.new['m2m_field']['value'], [])
+
     @override_settings(SIMPLE_LOG_ENABLED=False)
     def test_enabled(self):
         initial_count = SimpleLog.objects.count()
         TestModel.objects.create(char_field='test')
         OtherModel.objects.create(char_field='test')
         self.assertEqual(SimpleLog.objects.count(), initial_count)
+
+    def test_snapshot_on_load(self):
+        obj = TestModel.objects.create(char_field='test')
+        obj = TestModel.objects.get(pk=obj.pk)
+        self.assertFalse(hasattr(obj, SNAPSHOT_ATTR_NAME))
+
+        with override_settings(SIMPLE_LOG_SNAPSHOT_ON_LOAD=True):
+            obj = TestModel.objects.get(pk=obj.pk)
+            # Only m2m field of old instance is fetched
+            with self.assertNumQueries(1):
+                SimpleLog.set_initial(obj)
+            self.assertEqual(obj._old_value['char_field']['value'], 'test')
+
+            obj = TestModel.objects.get(pk=obj.pk)
+            TestModel.objects.filter(pk=obj.pk).update(char_field='updated')
+            initial_count = SimpleLog.objects.count()
+            obj.char_field = 'changed'
+            obj.save()
+            self.assertEqual(SimpleLog.objects.count(), initial_count + 1)
+            sl = SimpleLog.objects.latest('pk')
+            self.assertEqual(sl.old['char_field']['value'], 'test')
+            self.assertEqual(sl.new['char_field']['value'], 'changed')
+
+            # Mutable values are copied, they can be changed in place
+            field_names = [x.attname for x in TestModel._meta.concrete_fields]
+            values = list(
+                TestModel.objects.values_list(*field_names).get(pk=obj.pk)
+            )
+            values[field_names.index('char_field')] = {'items': ['test']}
+            obj = TestModel.from_db('default', field_names, values)
+            obj.char_field['items'].append('changed')
+            _, _, snapshot_values = obj.__dict__[SNAPSHOT_ATTR_NAME]
+            self.assertEqual(
+                snapshot_values[field_names.index('char_field')],
+                {'items': ['test']},
+            )
+
+    def test_tracking_options_invalidation(self):
+        options = get_tracking_options(TestModel)
+        self.assertIs(get_tracking_options(TestModel), options)
+        self.assertTrue(options.file_name_only)
+        with override_settings(SIMPLE_LOG_FILE_NAME_ONLY=False):
+            self.assertIsNot(get_tracking_options(TestModel), options)
+            self.assertFalse(get_tracking_options(TestModel).file_name_only)
+        self.assertTrue(get_tracking_options(TestModel).file_name_only)
+
+    def test_fk_repr(self):
+        other_models = [
+            OtherModel.objects.create(char_field='other %s' % x)
+            for x in range(3)
+        ]
+        for other_model in other_models:
+            TestModel.objects.create(char_field='test', fk_field=other_model)
+        table = OtherModel._meta.db_table
+
+        def save_all():
+            initial_count = SimpleLog.objects.count()
+            with CaptureQueriesContext(connection) as ctx, atomic():
+                for obj in TestModel.objects.order_by('pk'):
+                    obj.char_field = 'changed'
+                    obj.save()
+            self.assertEqual(SimpleLog.objects.count(), initial_count + 3)
+            TestModel.objects.update(char_field='test')
+            return [
+                x['sql']
+                for x in ctx.captured_queries
+                if x['sql'].startswith('SELECT')
+                and 'FROM "%s"' % table in x['sql']
+                and 'JOIN' not in x['sql']
+            ]
+
+        # Old and new representations of every object
+        self.assertEqual(len(save_all()), 6)
+
+        with override_settings(SIMPLE_LOG_FK_REPR='batch'):
+            self.assertEqual(len(save_all()), 1)
+            logs = SimpleLog.objects.order_by('-pk')[:3][::-1]
+            for sl, other_model in zip(logs, other_models):
+                value = {'db': other_model.pk, 'repr': force_str(other_model)}
+                self.assertEqual(sl.old['fk_field']['value'], value)
+                self.assertEqual(sl.new['fk_field']['value'], value)
+
+        with override_settings(SIMPLE_LOG_FK_REPR='db'):
+            self.assertEqual(save_all(), [])
+            sl = SimpleLog.objects.latest('pk')
+            self.assertEqual(sl.new['fk_field']['value'], other_models[2].pk)
+
+    def test_compress(self):
+        def raw_new(pk):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT new FROM {} WHERE id = %s'.format(
+                        SimpleLog._meta.db_table
+                    ),
+                    [pk],
+                )
+                return json.loads(cursor.fetchone()[0])
+
+        TestModel.objects.create(char_field='plain')
+        plain = SimpleLog.objects.latest('pk')
+        self.assertIn('char_field', raw_new(plain.pk))
+        for compressor in ('zlib', 'lzma'):
+            with override_settings(
+                SIMPLE_LOG_COMPRESS=compressor,
+                SIMPLE_LOG_COMPRESS_THRESHOLD=10,
+            ):
+                obj = TestModel.objects.create(char_field=compressor)
+                sl = SimpleLog.objects.latest('pk')
+                self.assertListEqual(list(raw_new(sl.pk)), ['$' + compressor])
+                self.assertEqual(sl.new['char_field']['value'], compressor)
+                obj.char_field = 'changed'
+                obj.save()
+                sl = SimpleLog.objects.latest('pk')
+                self.assertEqual(sl.old['char_field']['value'], compressor)
+                self.assertListEqual(
+                    sl.get_differences(),
+                    [
+                        {
+                            'label': 'Char field',
+                            'old': compressor,
+                            'new': 'changed',
+                        }
+                    ],
+                )
+
+        # Small values are not compressed
+        with override_settings(SIMPLE_LOG_COMPRESS='zlib'):
+            TestModel.objects.create(char_field='small')
+            sl = SimpleLog.objects.latest('pk')
+            self.assertIn('char_field', raw_new(sl.pk))
+
+        with override_settings(
+            SIMPLE_LOG_COMPRESS='zlib', SIMPLE_LOG_COMPRESS_THRESHOLD=10
+        ):
+            call_command('compress_logs', batch_size=2, stdout=StringIO())
+        self.assertListEqual(list(raw_new(plain.pk)), ['$zlib'])
+        self.assertEqual(
+            SimpleLog.objects.get(pk=plain.pk).new['char_field']['value'],
+            'plain',
+        )
+        call_command('compress_logs', stdout=StringIO())
+        self.assertIn('char_field', raw_new(plain.pk))
+
+    def test_schema_encoding(self):
+        def raw_values(pk):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT old, new FROM {} WHERE id = %s'.format(
+                        SimpleLog._meta.db_table
+                    ),
+                    [pk],
+                )
+                return [json.loads(x) if x else x for x in cursor.fetchone()]
+
+        other_model = OtherModel.objects.create(char_field='other')
+        with override_settings(SIMPLE_LOG_SCHEMA_ENCODING=True):
+            obj = TestModel.objects.create(
+                char_field='test', fk_field=other_model
+            )
+            obj.m2m_field.add(other_model)
+            self.assertEqual(SnapshotSchema.objects.count(), 1)
+            sl = SimpleLog.objects.latest('pk')
+            old, new = raw_values(sl.pk)
+            schema = SnapshotSchema.objects.get(pk=new['$schema'])
+            self.assertEqual(old['$schema'], schema.pk)
+            self.assertEqual(
+                schema.content_type, ContentType.objects.get_for_model(obj)
+            )
+            self.assertListEqual(
+                schema.fields,
+                [
+                    ['char_field', 'Char field', SnapshotSchema.PLAIN],
+                    ['fk_field', 'Fk field', SnapshotSchema.PAIR],
+                    ['choice_field', 'Choice field', SnapshotSchema.PAIR],
+                    ['m2m_field', 'M2m field', SnapshotSchema.PAIRS],
+                ],
+            )
+            self.assertListEqual(
+                new['$values'],
+                [
+                    'test',
+                    [other_model.pk, 'other'],
+                    [1, 'One'],
+                    [[other_model.pk, 'other']],
+                ],
+            )
+            self.assertDictEqual(sl.changed_fields, {'m2m_field': 'M2m field'})
+            self.assertListEqual(
+                sl.get_differences(),
+                [
+                    {
+                        'label': 'M2m field',
+                        'old': [],
+                        'new': [{'db': other_model.pk, 'repr': 'other'}],
+                    }
+                ],
+            )
+
+            # Saved schema is not queried again
+            obj = TestModel.objects.get(pk=obj.pk)
+            obj.char_field = 'changed'
+            with CaptureQueriesContext(connection) as ctx:
+                obj.save()
+            table = SnapshotSchema._meta.db_table
+            self.assertFalse(
+                [x for x in ctx.captured_queries if table in x['sql']]
+            )
+            self.assertEqual(SnapshotSchema.objects.count(), 1)
+
+            # Schema of rolled back transaction is saved again
+            with disable_logging():
+                third_model = ThirdModel.objects.create(char_field='third')
+            params = SimpleLog.get_log_params(
+                third_model,
+                action_flag=SimpleLog.ADD,
+                new=serialize_instance(third_model),
+            )
+            with atomic():
+                SimpleLog.objects.create(**params)
+                set_rollback(True)
+            self.assertEqual(SnapshotSchema.objects.count(), 1)
+            SimpleLog.objects.create(**params)
+            self.assertEqual(SnapshotSchema.objects.count(), 2)
+            sl = SimpleLog.objects.latest('pk')
+            self.assertEqual(sl.new['char_field']['value'], 'third')
+
+            # Schemas are saved with one query before logs
+            with disable_logging():
+                related = RelatedModel.objects.create(
+                    third_model=third_model, char_field='related'
+                )
+            logs = [
+                SimpleLog(
+                    **SimpleLog.get_log_params(
+                        x,
+                        action_flag=SimpleLog.ADD,
+                        new=serialize_instance(x),
+                    )
+                )
+                for x in (other_model, related)
+            ]
+            with CaptureQueriesContext(connection) as ctx:
+                SimpleLog.bulk_save(logs)
+            inserts = [
+                x['sql']
+                for x in ctx.captured_queries
+                if x['sql'].startswith('INSERT')
+            ]
+            self.assertEqual(len(inserts), 2)
+            self.assertIn(table, inserts[0])
+            self.assertFalse(
+                [
+                    x
+                    for x in ctx.captured_queries
+                    if table in x['sql'] and x['sql'] not in inserts
+                ]
+            )
+            self.assertEqual(SnapshotSchema.objects.count(), 4)
+            self.assertEqual(
+                SimpleLog.objects.get(pk=logs[1].pk).new['char_field'][
+                    'value'
+                ],
+                'related',
+            )
+        sl = SimpleLog.objects.get(pk=sl.pk)
+        self.assertEqual(sl.new['char_field']['value'], 'third')
+
+        # Existing logs are encoded with one update query per batch
+        TestModel.objects.create(char_field='plain')
+        plain = SimpleLog.objects.latest('pk')
+        self.assertIn('char_field', raw_values(plain.pk)[1])
+        with override_settings(
+            SIMPLE_LOG_SCHEMA_ENCODING=True
+        ), CaptureQueriesContext(connection) as ctx:
+            call_command('compress_logs', stdout=StringIO())
+        self.assertEqual(
+            len([x for x in ctx.captured_queries if 'UPDATE' in x['sql']]), 1
+        )
+        self.assertIn('$schema', raw_values(plain.pk)[1])
+        plain = SimpleLog.objects.get(pk=plain.pk)
+        self.assertEqual(plain.new['char_field']['value'], 'plain')
+
+    @override_settings(SIMPLE_LOG_DEDUPLICATE=True)
+    def test_deduplicate(self):
+        obj = TestModel.objects.create(char_field='test')
+        for value in ('changed', 'test'):
+            obj = TestModel.objects.get(pk=obj.pk)
+            obj.char_field = value
+            obj.save()
+        # Snapshots "test" and "changed" are saved once
+        self.assertEqual(SnapshotBlob.objects.count(), 2)
+        logs = list(SimpleLog.objects.order_by('-pk')[:3])
+        self.assertDictEqual(
+            logs[0].__dict__['old'], {'$ref': logs[1].__dict__['new']['$ref']}
+        )
+        self.assertEqual(
+            logs[0].__dict__['new']['$ref'], logs[2].__dict__['new']['$ref']
+        )
+
+        # Lazy loading
+        with self.assertNumQueries(1):
+            self.assertEqual(logs[0].old['char_field']['value'], 'changed')
+        with self.assertNumQueries(0):
+            self.assertEqual(logs[0].old['char_field']['value'], 'changed')
+
+        # Bulk prefetch
+        logs = list(SimpleLog.objects.order_by('-pk')[:3])
+        with self.assertNumQueries(1):
+            self.assertListEqual(prefetch_snapshots(logs), logs)
+        with self.assertNumQueries(0):
+            self.assertListEqual(
+                [x.new['char_field']['value'] for x in logs],
+                ['test', 'changed', 'test'],
+            )
+            self.assertListEqual(
+                logs[0].get_differences(),
+                [{'label': 'Char field', 'old': 'changed', 'new': 'test'}],
+            )
+
+        # References are not replaced with values of blobs
+        with override_settings(
+            SIMPLE_LOG_COMPRESS='zlib', SIMPLE_LOG_COMPRESS_THRESHOLD=10
+        ):
+            call_command('compress_logs', stdout=StringIO())
+        logs = list(SimpleLog.objects.order_by('-pk')[:3])
+        self.assertDictEqual(
+            logs[0].__dict__['old'], {'$ref': logs[1].__dict__['new']['$ref']}
+        )
+        self.assertEqual(logs[0].old['char_field']['value'], 'changed')
+
+    @override_settings(
+        SIMPLE_LOG_POLICIES={
+            'test_app.TestModel': {'only_fields': ('char_field',)}
+        }
+    )
+    def test_policy_only_fields(self):
+        obj = TestModel.objects.create(char_field='test')
+        initial_count = SimpleLog.objects.count()
+        obj.choice_field = TestModel.TWO
+        # Only update query, initial state isn't fetched
+        with self.assertNumQueries(1):
+            obj.save(update_fields=['choice_field'])
+        obj.save()
+        self.assertEqual(SimpleLog.objects.count(), initial_count)
+
+        with override_settings(SIMPLE_LOG_SNAPSHOT_ON_LOAD=True):
+            obj = TestModel.objects.get(pk=obj.pk)
+            obj.choice_field = TestModel.ONE
+            with self.assertNumQueries(1):
+                obj.save()
+        self.assertEqual(SimpleLog.objects.count(), initial_count)
+
+        obj.char_field = 'changed'
+        obj.save()
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 1)
+        sl = SimpleLog.objects.latest('pk')
+        self.assertEqual(sl.new['char_field']['value'], 'changed')
+
+        # Skipped failed save doesn't skip the next save
+        def receiver(sender, **kwargs):
+            raise ValueError
+
+        pre_save.connect(receiver, sender=TestModel)
+        try:
+            with self.assertRaises(ValueError):
+                obj.save(update_fields=['choice_field'])
+        finally:
+            pre_save.disconnect(receiver, sender=TestModel)
+        obj.char_field = 'changed again'
+        obj.save()
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 2)
+
+    @override_settings(
+        SIMPLE_LOG_POLICIES={'test_app.TestModel': {'sample_rate': 0}}
+    )
+    def test_policy_sample_rate(self):
+        initial_count = SimpleLog.objects.count()
+        obj = TestModel.objects.create(char_field='test')
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 1)
+        obj.char_field = 'changed'
+        with self.assertNumQueries(1):
+            obj.save()
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 1)
+        obj.delete()
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 2)
+
+    @mock.patch.object(
+        TestModel, 'simple_log_rate_limit', (2, 3600), create=True
+    )
+    def test_policy_rate_limit(self):
+        with isolate_lru_cache(get_tracking_options):
+            objects = [
+                TestModel.objects.create(char_field='test') for _ in range(2)
+            ]
+            initial_count = SimpleLog.objects.count()
+            for i in range(4):
+                for obj in objects:
+                    obj.char_field = str(i)
+                    obj.save()
+            self.assertEqual(SimpleLog.objects.count(), initial_count + 4)
+            sl = SimpleLog.objects.filter(object_id=objects[0].pk).latest('pk')
+            self.assertEqual(sl.new['char_field']['value'], '1')
+
+            # Only created logs are counted
+            def receiver(sender, **kwargs):
+                raise ValueError
+
+            obj = TestModel.objects.create(char_field='test')
+            initial_count = SimpleLog.objects.count()
+            pre_save.connect(receiver, sender=TestModel)
+            try:
+                for i in range(2):
+                    obj.char_field = str(i)
+                    with self.assertRaises(ValueError):
+                        obj.save()
+            finally:
+                pre_save.disconnect(receiver, sender=TestModel)
+            obj.save()
+            obj.char_field = 'changed'
+            obj.save()
+            self.assertEqual(SimpleLog.objects.count(), initial_count + 2)
+            obj.char_field = 'skipped'
+            obj.save()
+            self.assertEqual(SimpleLog.objects.count(), initial_count + 2)
+
+    def test_writer(self):
+        with override_settings(
+            SIMPLE_LOG_WRITER='simple_log.writers.ThreadWriter',
+            SIMPLE_LOG_WRITER_OPTIONS={'flush_interval': 60},
+        ):
+            writer = get_writer()
+            self.assertIsInstance(writer, ThreadWriter)
+            other = OtherModel.objects.create(char_field='other')
+            for _ in range(3):
+                with atomic():
+                    obj = TestModel.objects.create(char_field='test')
+                    obj.m2m_field.add(other)
+            # Logs are saved in background
+            self.assertEqual(SimpleLog.objects.count(), 0)
+            writer.flush()
+            self.assertEqual(SimpleLog.objects.count(), 4)
+            obj.char_field = 'changed'
+            obj.save()
+        # Logs are saved on writer change
+        self.assertEqual(SimpleLog.objects.count(), 5)
+        sl = SimpleLog.objects.latest('pk')
+        self.assertEqual(sl.old['char_field']['value'], 'test')
+        self.assertEqual(sl.new['char_field']['value'], 'changed')
+        self.assertEqual(sl.new['m2m_field']['value'][0]['db'], other.pk)
+
+        # Logs are saved in place if queue is full
+        BlockingWriter.event.clear()
+        with override_settings(
+            SIMPLE_LOG_WRITER='tests.tests_settings.BlockingWriter',
+            SIMPLE_LOG_WRITER_OPTIONS={
+                'max_size': 1,
+                'flush_interval': 0,
+                'put_timeout': 0.01,
+            },
+        ):
+            with self.assertLogs('simple_log', 'WARNING'):
+                for _ in range(3):
+                    OtherModel.objects.create(char_field='other')
+            self.assertGreaterEqual(SimpleLog.objects.count(), 6)
+            BlockingWriter.event.set()
+            get_writer().flush()
+            self.assertEqual(SimpleLog.objects.count(), 8)
+
+    def test_spool_writer(self):
+        with tempfile.TemporaryDirectory() as path, override_settings(
+            SIMPLE_LOG_WRITER='simple_log.writers.SpoolWriter',
+            SIMPLE_LOG_WRITER_OPTIONS={'path': path, 'max_bytes': 1},
+        ):
+            writer = get_writer()
+            with disable_logging():
+                obj = TestModel.objects.create(char_field='test')
+            with atomic():
+                third = ThirdModel.objects.create(char_field='test')
+                RelatedModel.objects.create(
+                    third_model=third, char_field='inline'
+                )
+            OtherModel.objects.create(char_field='other')
+            writer.max_bytes = 1024 * 1024
+            obj.char_field = 'changed'
+            obj.save()
+            self.assertEqual(SimpleLog.objects.count(), 0)
+            # File is rotated if it's larger than max_bytes
+            segments = writer.get_segments()
+            self.assertEqual(len(segments), 2)
+            self.assertTrue(
+                os.path.exists(os.path.join(path, SpoolWriter.current_name))
+            )
+
+            # Segment ingested before restart is skipped
+            SpoolSegment.objects.create(name=segments[1])
+            out = StringIO()
+            call_command('ingest_logs', stdout=out)
+            self.assertEqual(
+                out.getvalue(), '2 logs are saved from 2 segments\n'
+            )
+            self.assertListEqual(writer.get_segments(), [])
+            self.assertFalse(SpoolSegment.objects.exists())
+            first_sl, second_sl = SimpleLog.objects.order_by('pk')
+            self.assertEqual(first_sl.object_id, str(third.pk))
+            self.assertEqual(second_sl.new['char_field']['value'], 'inline')
+            self.assertQuerySetEqual(
+                first_sl.related_logs.all(), [second_sl], transform=None
+            )
+
+            call_command('ingest_logs', path=path, rotate=True, stdout=out)
+            self.assertEqual(SimpleLog.objects.count(), 3)
+            sl = SimpleLog.objects.latest('pk')
+            self.assertEqual(sl.old['char_field']['value'], 'test')
+            self.assertEqual(sl.new['char_field']['value'], 'changed')
+            self.assertEqual(sl.action_time.date(), timezone.now().date())
+
+            # Segment is ingested once by concurrent commands
+            OtherModel.objects.create(char_field='concurrent')
+            writer.rotate()
+            name = writer.get_segments()[0]
+            results = []
+            with open(os.path.join(path, name), 'rb') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                thread = threading.Thread(
+                    target=lambda: results.append(writer.ingest(name))
+                )
+                thread.start()
+                thread.join(0.1)
+                self.assertTrue(thread.is_alive())
+                # Segment is ingested by command, that holds lock
+                os.remove(os.path.join(path, name))
+            thread.join()
+            self.assertListEqual(results, [0])
+            self.assertEqual(writer.ingest(name), 0)
+            self.assertEqual(SimpleLog.objects.count(), 3)
+
+
+@override_settings(
+    SIMPLE_LOG_MODEL='test_app.PlainLogModel', SIMPLE_LOG_DATABASE='logs'
+)
+class DatabaseTestCase(TransactionTestCase):
+    databases = {'default', 'logs'}
+
+    @isolate_lru_cache(get_log_model)
+    def test_database(self):
+        with atomic():
+            obj = TestModel.objects.create(char_field='test')
+            obj.char_field = 'changed'
+            obj.save()
+            self.assertFalse(PlainLogModel.objects.using('logs').exists())
+        self.assertFalse(PlainLogModel.objects.exists())
+        sl = PlainLogModel.objects.using('logs').get()
+        self.assertEqual(sl.content_type_label, 'test_app.testmodel')
+        self.assertEqual(
+            sl.content_type, ContentType.objects.get_for_model(TestModel)
+        )
+        self.assertEqual(sl.new['char_field']['value'], 'changed')
+        self.assertIsNone(sl.user)
+
+        user = User.objects.create_superuser('user', 'test@example.com', '')
+        sl = PlainLogModel(
+            **PlainLogModel.get_log_params(
+                obj, user=user, action_flag=PlainLogModel.CHANGE
+            )
+        )
+        self.assertEqual(sl.user_id, str(user.pk))
+        self.assertEqual(sl.user, user)
+
+        # Admin reads logs from database of logs
+        request = RequestFactory().get('/')
+        request.user = user
+        model_admin = SimpleLogModelAdmin(
+            PlainLogModel, admin.site, history_for_model=TestModel
+        )
+        self.assertListEqual(
+            model_admin.get_list_filter(request), ['action_flag']
+        )
+        queryset = model_admin.get_queryset(request)
+        self.assertEqual(queryset.db, 'logs')
+        self.assertEqual(queryset.get().object_id, str(obj.pk))
+        self.assertIn(
+            'content_type_label',
+            SimpleLogModelAdmin(PlainLogModel, admin.site).get_list_filter(
+                request
+            ),
+        )
+
+    @isolate_lru_cache(get_log_model)
+    def test_buffer_per_database(self):
+        logs = PlainLogModel.objects.using('logs')
+        initial_count = logs.count()
+        with atomic(using='logs'):
+            obj = TestModel.objects.using('logs').create(char_field='test')
+            obj.char_field = 'changed'
+            obj.save()
+            self.assertIsNotNone(LogBuffer.get_log(obj, 'logs'))
+            self.assertIsNone(LogBuffer.get_log(obj))
+            # Logs are saved on commit of database, that object is saved to
+            self.assertEqual(logs.count(), initial_count)
+        self.assertEqual(logs.count(), initial_count + 1)
+        sl = logs.latest('pk')
+        self.assertEqual(sl.action_flag, PlainLogModel.ADD)
+        self.assertEqual(sl.new['char_field']['value'], 'changed')
+
+        # Initial state of m2m change is read from database of object
+        other = OtherModel.objects.using('logs').create(char_field='other')
+        obj.m2m_field.add(other)
+        with atomic(using='logs'):
+            obj.m2m_field.remove(other)
+        sl = logs.filter(object_id=obj.pk).latest('pk')
+        self.assertEqual(sl.action_flag, PlainLogModel.CHANGE)
+        self.assertEqual(sl.old['m2m_field']['value'][0]['db'], other.pk)
+        self.assertListEqual(sl.new['m2m_field']['value'], [])
+
+    @isolate_lru_cache(get_log_model)
+    def test_schema_encoding(self):
+        obj = TestModel.objects.create(char_field='test')
+        with override_settings(
+            SIMPLE_LOG_DATABASE=None, SIMPLE_LOG_SCHEMA_ENCODING=True
+        ):
+            # Schema is saved to and read from database of log
+            sl = PlainLogModel(
+                **PlainLogModel.get_log_params(
+                    obj,
+                    action_flag=PlainLogModel.CHANGE,
+                    new=serialize_instance(obj),
+                )
+            )
+            sl.save(using='logs')
+            self.assertTrue(SnapshotSchema.objects.using('logs').exists())
+            self.assertFalse(SnapshotSchema.objects.exists())
+            sl = PlainLogModel.objects.using('logs').get(pk=sl.pk)
+            self.assertEqual(sl.new['char_field']['value'], 'test')
+
+    @isolate_lru_cache(get_log_model)
+    @override_settings(SIMPLE_LOG_DEDUPLICATE=True)
+    def test_deduplicate(self):
+        obj = TestModel.objects.create(char_field='test')
+        # Log model has no foreign key to content type
+        blobs = SnapshotBlob.objects.using('logs')
+        self.assertEqual(blobs.count(), 1)
+        self.assertIsNone(blobs.get().content_type)
+        sl = PlainLogModel.objects.using('logs').get()
+        self.assertEqual(sl.object_id, str(obj.pk))
+        self.assertEqual(sl.new['char_field']['value'], 'test')
+
+    @isolate_lru_cache(get_log_model)
+    def test_compress_logs(self):
+        TestModel.objects.create(char_field='test')
+        logs = PlainLogModel.objects.using('logs')
+        self.assertEqual(logs.count(), 1)
+        stdout = StringIO()
+        with override_settings(
+            SIMPLE_LOG_COMPRESS='zlib', SIMPLE_LOG_COMPRESS_THRESHOLD=10
+        ):
+            call_command('compress_logs', stdout=stdout)
+        self.assertIn('1 logs are saved', stdout.getvalue())
+        self.assertEqual(logs.get().new['char_field']['value'], 'test')
+        with connections['logs'].cursor() as cursor:
+            cursor.execute(
+                'SELECT new FROM {}'.format(PlainLogModel._meta.db_table)
+            )
+            self.assertListEqual(
+                list(json.loads(cursor.fetchone()[0])), ['$zlib']
+            )
+
+    @isolate_lru_cache(get_log_model)
+    def test_relations_per_database(self):
+        logs = PlainLogModel.objects.using('logs')
+        other_model = OtherModel.objects.using('logs').create(
+            char_field='other'
+        )
+        # Same primary key in default database with other representation
+        OtherModel.objects.create(pk=other_model.pk, char_field='default')
+        with override_settings(SIMPLE_LOG_FK_REPR='batch'), atomic(
+            using='logs'
+        ):
+            obj = TestModel.objects.using('logs').create(
+                char_field='test', fk_field_id=other_model.pk
+            )
+            obj.m2m_field.add(other_model)
+            other_model.char_field = 'changed'
+            other_model.save()
+        sl = logs.get(content_type_label='test_app.testmodel')
+        related_value = {'db': other_model.pk, 'repr': 'changed'}
+        self.assertDictEqual(sl.new['fk_field']['value'], related_value)
+        self.assertListEqual(sl.new['m2m_field']['value'], [related_value])
+        sl = logs.filter(content_type_label='test_app.othermodel').latest(
+            'pk'
+        )
+        self.assertListEqual(
+            sl.new['test_entries_fk']['value'],
+            [{'db': obj.pk, 'repr': 'test'}],
+        )
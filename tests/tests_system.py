@@ -1,11 +1,29 @@
-from django.db.transaction import atomic
+from django.apps import apps
+from django.db import NotSupportedError, connection
+from django.db.models.signals import pre_delete
+from django.db.transaction import atomic, set_rollback
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils.encoding import force_str
 
+from simple_log.buffer import LogBuffer
+from simple_log.managers import TrackedQuerySet
 from simple_log.models import SimpleLog
-from simple_log.utils import disable_logging, disable_related
-
-from .test_app.models import OtherModel, RelatedModel, TestModel, ThirdModel
+from simple_log.signals import log_pre_delete_handler
+from simple_log.utils import (
+    disable_logging,
+    disable_related,
+    find_related_logs,
+    is_related_to,
+)
+
+from .test_app.models import (
+    NestedModel,
+    OtherModel,
+    RelatedModel,
+    TestModel,
+    ThirdModel,
+)
 from .tests_admin import AdminTestCase
 from .utils import get_ctx
 
@@ -409,3 +427,423 @@ class SystemTestCase(AdminTestCase):
         second_sl = SimpleLog.objects.all()[1]
         self.assertQuerySetEqual(first_sl.related_logs.all(), [])
         self.assertQuerySetEqual(second_sl.related_logs.all(), [])
+
+    def test_find_related_logs(self):
+        with disable_logging():
+            thirds = [
+                ThirdModel.objects.create(char_field=str(i)) for i in range(3)
+            ]
+            related = [
+                RelatedModel.objects.create(
+                    third_model=thirds[i % 3], char_field=str(i)
+                )
+                for i in range(6)
+            ]
+            tests = [
+                TestModel.objects.create(fk_field=self.other_model)
+                for i in range(2)
+            ]
+        with atomic():
+            for i, obj in enumerate(thirds + related + tests):
+                SimpleLog.log(
+                    obj,
+                    action_flag=SimpleLog.CHANGE,
+                    with_initial=True,
+                    commit=bool(i % 2),
+                )
+            SimpleLog.log(self.other_model, action_flag=SimpleLog.CHANGE)
+            logs = list(LogBuffer.get().logs.values())
+
+            expected = []
+            for saved_log in [x for x in logs if x.pk]:
+                for log in logs:
+                    if is_related_to(saved_log, log):
+                        item = [x for x in expected if x[0] is log]
+                        if not item:
+                            item = [(log, [])]
+                            expected.append(item[0])
+                        item[0][1].append(saved_log)
+            self.assertTrue(expected)
+            self.assertEqual(find_related_logs(logs), expected)
+            set_rollback(True)
+
+    def test_save_related_bulk(self):
+        with atomic():
+            obj = self.add_object(ThirdModel, {'char_field': 'test'})
+            for i in range(3):
+                RelatedModel.objects.create(third_model=obj, char_field=str(i))
+        obj = ThirdModel.objects.get(pk=obj.pk)
+        initial_count = SimpleLog.objects.count()
+        last_pk = SimpleLog.objects.order_by('pk').last().pk
+        through = SimpleLog.related_logs.through
+        with CaptureQueriesContext(connection) as ctx:
+            with atomic():
+                for related in obj.related_entries.all():
+                    related.char_field = 'changed'
+                    related.save()
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 4)
+        new_logs = SimpleLog.objects.filter(pk__gt=last_pk).order_by('pk')
+        parent_sl = new_logs.get(object_repr=str(obj))
+        self.assertQuerySetEqual(
+            parent_sl.related_logs.order_by('pk'),
+            new_logs.exclude(pk=parent_sl.pk),
+            transform=None,
+        )
+        # Changed logs and unchanged parent log are inserted separately
+        for model, count in ((SimpleLog, 2), (through, 1)):
+            table = 'INTO "{}"'.format(model._meta.db_table)
+            inserts = [
+                x
+                for x in ctx.captured_queries
+                if x['sql'].startswith('INSERT') and table in x['sql']
+            ]
+            self.assertEqual(len(inserts), count)
+
+    @override_settings(SIMPLE_LOG_FK_REPR='batch')
+    def test_tracked_queryset(self):
+        def count_queries(func, *args, **kwargs):
+            with CaptureQueriesContext(connection) as ctx:
+                func(*args, **kwargs)
+            return len(ctx.captured_queries)
+
+        counts = []
+        # The first round caches content type
+        for n in (1, 2, 4):
+            with disable_logging():
+                TestModel.objects.all().delete()
+            queryset = TrackedQuerySet(TestModel)
+            objs = [
+                TestModel(char_field='test', fk_field=self.other_model)
+                for i in range(n)
+            ]
+            initial_count = SimpleLog.objects.count()
+            counts.append(
+                [
+                    count_queries(queryset.bulk_create, objs),
+                    count_queries(queryset.update, char_field='changed'),
+                ]
+            )
+            for obj in objs:
+                obj.char_field = 'bulk'
+            counts[-1] += [
+                count_queries(queryset.bulk_update, objs, ['char_field']),
+                count_queries(queryset.delete),
+            ]
+            self.assertEqual(SimpleLog.objects.count(), initial_count + 4 * n)
+        # Number of queries doesn't depend on number of rows
+        self.assertListEqual(counts[1], counts[2])
+
+        logs = SimpleLog.objects.filter(object_id=objs[0].pk).order_by('-pk')
+        self.assertListEqual(
+            [
+                (x.action_flag, x.old and x.old['char_field']['value'])
+                for x in logs[:4]
+            ],
+            [
+                (SimpleLog.DELETE, 'bulk'),
+                (SimpleLog.CHANGE, 'changed'),
+                (SimpleLog.CHANGE, 'test'),
+                (SimpleLog.ADD, None),
+            ],
+        )
+        self.assertEqual(logs[1].new['char_field']['value'], 'bulk')
+        self.assertEqual(
+            logs[3].new['fk_field']['value']['db'], self.other_model.pk
+        )
+
+        # Matched rows may be locked
+        obj = TestModel.objects.create(char_field='test')
+        initial_count = SimpleLog.objects.count()
+        self.assertEqual(
+            queryset.filter(pk=obj.pk)
+            .select_for_update()
+            .update(char_field='locked'),
+            1,
+        )
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 1)
+
+        # Same checks as QuerySet.delete
+        obj = TestModel.objects.create(char_field='distinct')
+        initial_count = SimpleLog.objects.count()
+        queryset.filter(pk=obj.pk).distinct().delete()
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 1)
+        with self.assertRaises(NotSupportedError):
+            queryset.union(queryset).delete()
+
+    @override_settings(SIMPLE_LOG_FK_REPR='batch')
+    def test_fast_delete(self):
+        # Handlers aren't connected with SIMPLE_LOG_FAST_DELETE
+        uids = [
+            (
+                apps.get_app_config('simple_log').uid.format(x, label),
+                label,
+            )
+            for x in ('pre_delete', 'post_delete')
+            for label in (
+                RelatedModel._meta.label,
+                NestedModel._meta.label,
+            )
+        ]
+        for uid, label in uids:
+            pre_delete.disconnect(sender=label, dispatch_uid=uid)
+        try:
+            counts = []
+            # The first round caches content types
+            for n in (1, 2, 4):
+                with disable_logging():
+                    obj = ThirdModel.objects.create(char_field='third')
+                    related = RelatedModel.objects.bulk_create(
+                        [
+                            RelatedModel(third_model=obj, char_field=str(i))
+                            for i in range(n)
+                        ]
+                    )
+                    # Collector loads rows of related model with deferred
+                    # fields, because they have cascade of their own
+                    nested = NestedModel.objects.bulk_create(
+                        [
+                            NestedModel(
+                                related_model=x, char_field=x.char_field
+                            )
+                            for x in related
+                        ]
+                    )
+                initial_count = SimpleLog.objects.count()
+                with CaptureQueriesContext(connection) as ctx:
+                    TrackedQuerySet(ThirdModel).filter(pk=obj.pk).delete()
+                counts.append(len(ctx.captured_queries))
+                self.assertEqual(
+                    SimpleLog.objects.count(), initial_count + 2 * n + 1
+                )
+                # Nested rows are deleted with one query
+                table = NestedModel._meta.db_table
+                self.assertEqual(
+                    len(
+                        [
+                            x
+                            for x in ctx.captured_queries
+                            if x['sql'].startswith('DELETE')
+                            and table in x['sql']
+                        ]
+                    ),
+                    1,
+                )
+            self.assertEqual(counts[1], counts[2])
+        finally:
+            for uid, label in uids:
+                pre_delete.connect(
+                    log_pre_delete_handler, sender=label, dispatch_uid=uid
+                )
+
+        sl = SimpleLog.objects.get(
+            content_type__model='relatedmodel', object_id=related[-1].pk
+        )
+        self.assertEqual(sl.action_flag, SimpleLog.DELETE)
+        self.assertEqual(sl.old['char_field']['value'], '3')
+        self.assertEqual(sl.old['third_model']['value']['db'], obj.pk)
+        parent_sl = SimpleLog.objects.get(
+            action_flag=SimpleLog.DELETE,
+            object_id=obj.pk,
+            content_type__model='thirdmodel',
+        )
+        self.assertIn(sl, parent_sl.related_logs.all())
+        sl = SimpleLog.objects.get(
+            content_type__model='nestedmodel', object_id=nested[-1].pk
+        )
+        self.assertEqual(sl.action_flag, SimpleLog.DELETE)
+        self.assertEqual(sl.old['char_field']['value'], '3')
+
+    def test_delete_cascade_bulk(self):
+        others = list(OtherModel.objects.all()[:2])
+        counts = []
+        # The first round caches content types
+        for n in (1, 2, 4):
+            with disable_logging():
+                objects = [
+                    TestModel.objects.create(char_field=str(i))
+                    for i in range(n)
+                ]
+                for obj in objects:
+                    obj.m2m_field.set(others)
+            initial_count = SimpleLog.objects.count()
+            with CaptureQueriesContext(connection) as ctx:
+                TestModel.objects.filter(
+                    pk__in=[x.pk for x in objects]
+                ).delete()
+            counts.append(len(ctx.captured_queries))
+            self.assertEqual(SimpleLog.objects.count(), initial_count + n)
+        self.assertEqual(counts[1], counts[2])
+        sl = SimpleLog.objects.latest('pk')
+        self.assertEqual(sl.action_flag, SimpleLog.DELETE)
+        self.assertEqual(
+            [x['db'] for x in sl.old['m2m_field']['value']],
+            [x.pk for x in others],
+        )
+
+    def test_delete_changed_origin(self):
+        with disable_logging():
+            obj = ThirdModel.objects.create(char_field='third')
+        obj.char_field = 'changed'
+        obj.delete()
+        sl = SimpleLog.objects.latest('pk')
+        self.assertEqual(sl.action_flag, SimpleLog.DELETE)
+        self.assertEqual(sl.old['char_field']['value'], 'third')
+
+    def test_delete_rolled_back(self):
+        def receiver(sender, instance, **kwargs):
+            raise ValueError
+
+        obj = TestModel.objects.create(char_field='test')
+        initial_count = SimpleLog.objects.count()
+        # Receiver is called after handler of logs
+        pre_delete.connect(receiver, sender=TestModel)
+        try:
+            with self.assertRaises(ValueError):
+                obj.delete()
+            TestModel.objects.count()
+            with atomic():
+                with self.assertRaises(ValueError), atomic():
+                    obj.delete()
+                TestModel.objects.count()
+        finally:
+            pre_delete.disconnect(receiver, sender=TestModel)
+        # Batch of rolled back delete isn't logged by the next query
+        self.assertEqual(SimpleLog.objects.count(), initial_count)
+        self.assertTrue(TestModel.objects.filter(pk=obj.pk).exists())
+
+        obj.delete()
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 1)
+        self.assertEqual(
+            SimpleLog.objects.latest('pk').action_flag, SimpleLog.DELETE
+        )
+
+    def test_delete_cascade_old_instance(self):
+        with disable_logging():
+            obj = ThirdModel.objects.create(char_field='third')
+            related = RelatedModel.objects.create(
+                third_model=obj, char_field='related'
+            )
+        with atomic():
+            obj.delete()
+            logs = [
+                x
+                for x in LogBuffer.get().logs.values()
+                if isinstance(x.instance, RelatedModel)
+            ]
+            self.assertEqual(len(logs), 1)
+            # Primary key of deleted instance is kept in old instance
+            self.assertIsNone(logs[0].instance.pk)
+            self.assertEqual(logs[0].instance._old_instance.pk, related.pk)
+        sl = SimpleLog.objects.latest('pk')
+        self.assertEqual(sl.object_id, str(related.pk))
+        self.assertEqual(sl.old['char_field']['value'], 'related')
+
+    def test_log_buffer(self):
+        initial_count = SimpleLog.objects.count()
+        with atomic():
+            for i in range(3):
+                connection.on_commit(lambda: None)
+                TestModel.objects.create(char_field=str(i))
+            buffer = LogBuffer.get()
+            self.assertEqual(len(buffer.logs), 3)
+            hooks = [x[1] for x in connection.run_on_commit]
+            self.assertEqual(hooks.count(buffer.commit), 1)
+        self.assertIsNone(LogBuffer.get())
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 3)
+
+        with atomic():
+            obj = TestModel.objects.create(char_field='rolled back')
+            set_rollback(True)
+        # Buffer of rolled back transaction is dropped
+        self.assertIsNone(LogBuffer.get_log(obj))
+        with atomic():
+            TestModel.objects.create(char_field='test')
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 4)
+
+    def test_log_buffer_savepoints(self):
+        initial_count = SimpleLog.objects.count()
+        with atomic():
+            first = TestModel.objects.create(char_field='first')
+            try:
+                with atomic():
+                    TestModel.objects.create(char_field='inner')
+                    with atomic():
+                        TestModel.objects.create(char_field='nested')
+                    raise ValueError
+            except ValueError:
+                pass
+            with atomic():
+                TestModel.objects.create(char_field='second')
+                with atomic():
+                    TestModel.objects.create(char_field='third')
+                    set_rollback(True)
+            # Log of outer block is restored
+            log = LogBuffer.get_log(first)
+            with atomic():
+                SimpleLog.log(
+                    first, action_flag=SimpleLog.CHANGE, commit=False
+                )
+                set_rollback(True)
+            self.assertIs(LogBuffer.get_log(first), log)
+            self.assertEqual(len(LogBuffer.get().logs), 2)
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 2)
+        self.assertEqual(
+            {
+                x.new['char_field']['value']
+                for x in SimpleLog.objects.all()[:2]
+            },
+            {'first', 'second'},
+        )
+
+    def test_log_buffer_commit_after_savepoint(self):
+        initial_count = SimpleLog.objects.count()
+        with atomic():
+            TestModel.objects.create(char_field='kept')
+            with atomic():
+                TestModel.objects.create(char_field='released')
+            try:
+                with atomic():
+                    TestModel.objects.create(char_field='rolled back')
+                    raise ValueError
+            except ValueError:
+                pass
+            try:
+                with atomic():
+                    with atomic():
+                        TestModel.objects.create(char_field='nested')
+                    raise ValueError
+            except ValueError:
+                pass
+        # Transaction is committed right after rolled back savepoints
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 2)
+        self.assertEqual(
+            {
+                x.new['char_field']['value']
+                for x in SimpleLog.objects.all()[:2]
+            },
+            {'kept', 'released'},
+        )
+
+    def test_log_buffer_released_savepoint(self):
+        initial_count = SimpleLog.objects.count()
+        with atomic():
+            TestModel.objects.create(char_field='first')
+            with atomic():
+                with atomic():
+                    TestModel.objects.create(char_field='released')
+                with atomic():
+                    TestModel.objects.create(char_field='rolled back')
+                    set_rollback(True)
+                TestModel.objects.create(char_field='outer')
+                # Released savepoint is rolled back with outer one
+                set_rollback(True)
+            TestModel.objects.create(char_field='second')
+            self.assertEqual(len(LogBuffer.get().logs), 2)
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 2)
+        self.assertEqual(
+            {
+                x.new['char_field']['value']
+                for x in SimpleLog.objects.all()[:2]
+            },
+            {'first', 'second'},
+        )
@@ -1,8 +1,19 @@
+from django.db import connection
+from django.db.transaction import atomic
 from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 
+from simple_log.conf import settings
+from simple_log.models import ModelSerializer, SimpleLog
 from simple_log.templatetags.simple_log_tags import get_type
+from simple_log.utils import (
+    disable_logging,
+    prefetch_initial,
+    serialize_instance,
+    serialize_instances,
+)
 
-from .test_app.models import TestModel
+from .test_app.models import OtherModel, TestModel
 
 
 class UtilsTestCase(TransactionTestCase):
@@ -18,3 +29,120 @@ class UtilsTestCase(TransactionTestCase):
         )
         for value, type_of in params:
             self.assertEqual(get_type(value), type_of)
+
+    def test_serialize_instances(self):
+        with disable_logging():
+            other = [
+                OtherModel.objects.create(char_field='other{}'.format(i))
+                for i in range(3)
+            ]
+            for i in range(3):
+                obj = TestModel.objects.create(char_field='test{}'.format(i))
+                obj.m2m_field.set(other[i:])
+                other[i].m2m_field.set([obj])
+                TestModel.objects.create(char_field='fk', fk_field=other[i])
+        objects = list(TestModel.objects.select_related('fk_field'))
+        expected = [serialize_instance(x) for x in objects]
+        # Through table and related model
+        with self.assertNumQueries(2):
+            self.assertListEqual(serialize_instances(objects), expected)
+
+        objects = list(OtherModel.objects.all())
+        expected = [serialize_instance(x) for x in objects]
+        # Through table, related model and one to many field
+        with self.assertNumQueries(3):
+            self.assertListEqual(serialize_instances(objects), expected)
+        self.assertEqual(
+            expected[2]['test_entries_fk']['value'],
+            [{'db': objects[2].test_entries_fk.get().pk, 'repr': 'fk'}],
+        )
+
+        # Logs of transaction are serialized together
+        objects = list(TestModel.objects.select_related('fk_field'))
+        initial_count = SimpleLog.objects.count()
+        with CaptureQueriesContext(connection) as ctx, atomic():
+            for obj in objects:
+                obj.char_field += ' changed'
+                obj.save()
+            start = len(ctx.captured_queries)
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 6)
+        # Through table and related model
+        self.assertEqual(
+            len(
+                [
+                    x
+                    for x in ctx.captured_queries[start:]
+                    if x['sql'].startswith('SELECT')
+                ]
+            ),
+            2,
+        )
+        sl = SimpleLog.objects.filter(object_id=objects[0].pk).latest('pk')
+        self.assertEqual(
+            sl.new['m2m_field']['value'],
+            [{'db': x.pk, 'repr': x.char_field} for x in other],
+        )
+
+    def test_prefetch_initial(self):
+        with disable_logging():
+            for i in range(3):
+                TestModel.objects.create(char_field='test{}'.format(i))
+        objects = list(TestModel.objects.all())
+        with self.assertNumQueries(1):
+            self.assertListEqual(
+                prefetch_initial(objects, batch_size=10), objects
+            )
+        for obj in objects:
+            old = getattr(obj, settings.OLD_INSTANCE_ATTR_NAME)
+            self.assertEqual(old.pk, obj.pk)
+            self.assertIsNot(old, obj)
+
+        # Only m2m field of old instance is fetched
+        with self.assertNumQueries(1):
+            SimpleLog.set_initial(objects[0])
+
+        objects = list(TestModel.objects.all())
+        with self.assertNumQueries(2):
+            prefetch_initial(objects, batch_size=2)
+
+        initial_count = SimpleLog.objects.count()
+        for obj in objects:
+            obj.char_field = 'changed'
+            obj.save()
+        self.assertEqual(SimpleLog.objects.count(), initial_count + 3)
+        for sl in SimpleLog.objects.all()[:3]:
+            self.assertEqual(sl.old['char_field']['value'][:4], 'test')
+            self.assertEqual(sl.new['char_field']['value'], 'changed')
+
+    def test_serializer_overrides(self):
+        class OtherValueSerializer(ModelSerializer):
+            def get_other_value(self, instance, field):
+                return 'other'
+
+        class FieldValueSerializer(ModelSerializer):
+            def get_field_value(self, instance, field):
+                return field.name
+
+        class ValueForTypeSerializer(ModelSerializer):
+            @staticmethod
+            def get_value_for_type(value):
+                return 'value'
+
+        obj = TestModel.objects.create(char_field='test')
+        serializer = ModelSerializer()
+        self.assertEqual(
+            serializer(obj)['char_field'],
+            {'label': 'Char field', 'value': 'test'},
+        )
+        self.assertIs(
+            serializer.get_plan(TestModel), serializer.get_plan(TestModel)
+        )
+        self.assertEqual(
+            OtherValueSerializer()(obj)['char_field']['value'], 'other'
+        )
+        self.assertEqual(
+            FieldValueSerializer()(obj)['fk_field']['value'], 'fk_field'
+        )
+        self.assertEqual(
+            ValueForTypeSerializer()(obj)['char_field']['value'], 'value'
+        )